@@ -20,10 +20,14 @@ Date: 07/14/2025
 print("[🔁 DEBUG] Importing libraries...")
 import cv2
 import numpy as np
-import math
 import time
 import os
 import socket
+import threading
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from collections import defaultdict
 from datetime import datetime
 from ultralytics import YOLO
 from sort import *
@@ -38,12 +42,26 @@ import pytz
 print("[⚙️ DEBUG] Setting configuration variables...")
 VIDEO_SOURCE = "test_boats.mp4" 
 MODEL_PATH = "yolov8n.pt"
+INT8_MODEL_PATH = "yolov8n_int8_openvino_model"  # INT8 OpenVINO export of MODEL_PATH, used when present (CPU/Pi)
+INT8_CALIB_DATA = "coco128.yaml"  # dataset yaml for INT8 calibration; point at boat footage for best accuracy
 CLASS_FILTER = "boat"
 CONFIDENCE_THRESHOLD = 0.15
+IOU_THRESHOLD = 0.45
+IMGSZ = 640  # frames wider than this are downscaled once before inference
+MOTION_THRESH = 2.0  # mean gray-level change (0-255) below which YOLO is skipped; 0 = always run
 SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_PAD = 20  # context pixels kept around the boat
+SNAPSHOT_JPEG_QUALITY = 80
 GSHEET_CREDS_FILE = "gsheets_creds.json"
 GOOGLE_SHEET_NAME = "Boat Counter Logs"
 COOLDOWN_SECONDS = 5
+STALE_ID_SECONDS = 300  # forget IDs the tracker hasn't reported for this long...
+PRUNE_EVERY_FRAMES = 1000  # ...checked every this many frames
+SHEET_BATCH_ROWS = 10  # flush queued sheet rows at this many...
+SHEET_FLUSH_SECONDS = 5  # ...or after this many seconds
+BATCH_SIZE = 8  # frames per YOLO call; 1 = per-frame inference
+DISPLAY_WINDOW = True  # False = headless: no imshow/waitKey or overlay drawing
+HEADLESS = not DISPLAY_WINDOW
 
 # === LOCATION CONFIG FOR DAYLIGHT-AWARE MODE ===
 CITY = LocationInfo("Colorado Springs", "USA", "MST", 38.8339, -104.8214)
@@ -56,11 +74,32 @@ def is_daytime():
     print(f"[🕒 DEBUG] Checking if daytime: Now={now}, Sunrise={s['sunrise']}, Sunset={s['sunset']}")
     return s["sunrise"] <= now <= s["sunset"]
 
+def fit_to_imgsz(frame, interpolation=cv2.INTER_AREA):
+    h, w = frame.shape[:2]
+    if w <= IMGSZ:
+        return frame
+    return cv2.resize(frame, (IMGSZ, int(h * IMGSZ / w)), interpolation=interpolation)
+
+motion_bg = None
+
+def has_motion(frame):
+    global motion_bg
+    gray = cv2.cvtColor(cv2.resize(frame, (160, 90), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    if motion_bg is None:
+        motion_bg = gray.astype(np.float32)
+        return True
+    motion = cv2.absdiff(gray, cv2.convertScaleAbs(motion_bg)).mean()
+    cv2.accumulateWeighted(gray, motion_bg, 0.02)
+    return motion >= MOTION_THRESH
+
 def setup_capture():
     print("[📷 DEBUG] Setting up video capture...")
     cap = cv2.VideoCapture(VIDEO_SOURCE)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
+    if isinstance(VIDEO_SOURCE, int):
+        # Keep only the newest frame in the driver so reads after a slow batch aren't stale
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     return cap
 
 def shutdown_display():
@@ -102,21 +141,84 @@ if has_internet():
 else:
     print("[❌] No internet — skipping Google Sheets setup.")
 
+# Rows are appended from a background thread in batches so a slow HTTPS
+# round-trip never stalls the frame loop. None tells the writer to stop.
+sheet_q = Queue()
+
+def sheet_writer():
+    rows = []
+    deadline = None
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)
+            if row is None:
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SECONDS
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            try:
+                sheet.append_rows(rows)
+                print(f"[📊 LOGGED] Added {len(rows)} entries to Google Sheet")
+            except Exception as e:
+                print(f"[❌ ERROR] Google Sheets write failed ({len(rows)} rows): {e}")
+            rows, deadline = [], None
+
+sheet_thread = None
+if sheet:
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
 # === OPTIONAL MASK LOADING ===
 print("[🖼️ DEBUG] Attempting to load mask.png...")
 mask = None
+roi_x0, roi_y0 = 0, 0
 if os.path.exists("mask.png"):
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)
+    mask = fit_to_imgsz(mask, cv2.INTER_NEAREST)
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
-    print("[🧭] Mask loaded successfully.")
+    # Crop YOLO input to the mask's bounding box; boxes are shifted back later
+    ys, xs = np.nonzero(mask)
+    if ys.size:
+        roi_y0, roi_y1 = int(ys.min()), int(ys.max()) + 1
+        roi_x0, roi_x1 = int(xs.min()), int(xs.max()) + 1
+    else:
+        roi_y1, roi_x1 = mask.shape
+    mask_crop = mask[roi_y0:roi_y1, roi_x0:roi_x1]
+    print(f"[🧭] Mask loaded successfully. ROI x={roi_x0}:{roi_x1} y={roi_y0}:{roi_y1}")
 else:
     print("[ℹ️] No mask found – using full frame.")
 
+def apply_mask(frame):
+    if mask is None:
+        return frame
+    sub = frame[roi_y0:roi_y1, roi_x0:roi_x1]
+    return cv2.bitwise_and(sub, sub, mask=mask_crop)
+
 print("[📁 DEBUG] Ensuring snapshot directory exists...")
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+snap_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
 
-print(f"[🧠 DEBUG] Loading YOLO model from {MODEL_PATH}...")
-model = YOLO(MODEL_PATH)
+if not os.path.exists(INT8_MODEL_PATH):
+    # One-time post-training quantization; needs the openvino package
+    print(f"[⚡ DEBUG] Exporting INT8 OpenVINO model from {MODEL_PATH}...")
+    try:
+        INT8_MODEL_PATH = YOLO(MODEL_PATH).export(format="openvino", int8=True, dynamic=True, imgsz=IMGSZ, data=INT8_CALIB_DATA)
+    except Exception as e:
+        print(f"[⚠️ DEBUG] INT8 export unavailable, using PyTorch weights: {e}")
+if os.path.exists(INT8_MODEL_PATH):
+    print(f"[🧠 DEBUG] Loading INT8 YOLO model from {INT8_MODEL_PATH}...")
+    model = YOLO(INT8_MODEL_PATH, task="detect")
+else:
+    print(f"[🧠 DEBUG] Loading YOLO model from {MODEL_PATH}...")
+    model = YOLO(MODEL_PATH)
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"[❌ ERROR] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
+print(f"[🧠 DEBUG] Counting class '{CLASS_FILTER}' (id {BOAT_CLASS_ID})")
 
 print("[🔄 DEBUG] Initializing SORT tracker...")
 tracker = Sort(max_age=30, min_hits=3, iou_threshold=0.4)
@@ -125,18 +227,62 @@ tracker = Sort(max_age=30, min_hits=3, iou_threshold=0.4)
 print("[📊 DEBUG] Initializing tracking variables...")
 totalCount = []
 counted_ids = set()
-id_history = {}
 last_count_time = {}
-
-print("[🎥] Starting boat detection test. Press 'Q' to exit.")
+last_seen = {}
+frame_count = 0
+
+# Centroid history: per-ID int16 ring buffer (row 0 = x, row 1 = y) plus a write counter
+HISTORY_LEN = 15
+hist_xy = defaultdict(lambda: np.zeros((2, HISTORY_LEN), np.int16))
+hist_count = defaultdict(int)
+
+def push_center(id, cx, cy):
+    """Write a centroid into the ID's ring buffer, overwriting the oldest once full."""
+    k = hist_count[id]
+    hist_xy[id][:, k % HISTORY_LEN] = (cx, cy)
+    hist_count[id] = k + 1
+
+def history(id):
+    """The ID's valid centroids as a (2, n) array of x and y rows, oldest first."""
+    k = hist_count[id]
+    if k <= HISTORY_LEN:
+        return hist_xy[id][:, :k]
+    head = k % HISTORY_LEN
+    return np.concatenate((hist_xy[id][:, head:], hist_xy[id][:, :head]), axis=1)
+
+def prune_stale_ids(now):
+    """Drop per-ID state for tracks unseen for STALE_ID_SECONDS so long runs don't leak memory."""
+    stale = [k for k, t in last_seen.items() if now - t > STALE_ID_SECONDS]
+    for k in stale:
+        hist_xy.pop(k, None)
+        hist_count.pop(k, None)
+        last_count_time.pop(k, None)
+        last_seen.pop(k, None)
+        counted_ids.discard(k)
+    if stale:
+        print(f"[🧹 DEBUG] Pruned {len(stale)} stale track IDs, {len(last_seen)} still active")
+
+print(f"[🎥] Starting boat detection test. Press {'Ctrl+C' if HEADLESS else 'Q'} to exit.")
 
 last_checked_day = None
 cap = None
-frame_width, frame_height = 640, 360
-line_x = frame_width // 2
-COUNT_LINE = [line_x, 0, line_x, frame_height]
+# Count line geometry is fixed for a given camera; set from the first frame
+frame_width, frame_height = None, None
+LINE_X = None
+
+frame_buf = []
+running = True
+
+def request_stop(signum, frame):
+    global running
+    print("[👋 DEBUG] SIGINT received — exiting...")
+    running = False
 
-while True:
+if HEADLESS:
+    # No window to press Q in, so Ctrl+C / kill -INT ends the loop cleanly
+    signal.signal(signal.SIGINT, request_stop)
+
+while running:
     current_day = datetime.now(TIMEZONE).date()
     if current_day != last_checked_day:
         print(f"[📆 DEBUG] New day detected: {current_day}")
@@ -148,9 +294,15 @@ while True:
             print("[🛑 DEBUG] Releasing video capture for sleep...")
             cap.release()
             cap = None
-        cv2.destroyAllWindows()
+        frame_buf = []
+        if not HEADLESS:
+            cv2.destroyAllWindows()
         shutdown_display()
-        time.sleep(300)
+        # Sleep in 1 s steps so a SIGINT doesn't wait out the full 5 minutes
+        for _ in range(300):
+            if not running:
+                break
+            time.sleep(1)
         continue
 
     if cap is None:
@@ -159,93 +311,117 @@ while True:
         cap = setup_capture()
 
     success, img = cap.read()
-    if not success:
+    if success:
+        img = fit_to_imgsz(img)
+        if LINE_X is None:
+            frame_height, frame_width = img.shape[:2]
+            LINE_X = frame_width // 2
+            print(f"[📏 DEBUG] Frame {frame_width}x{frame_height}, count line at x={LINE_X}")
+        masked = apply_mask(img)
+        frame_buf.append((img, masked, has_motion(masked)))
+        if len(frame_buf) < BATCH_SIZE:
+            continue
+    else:
         print("[✅] Finished processing video.")
-        break
-
-    frame_height, frame_width = img.shape[:2]
-    line_x = frame_width // 2
-    COUNT_LINE = [line_x, 0, line_x, frame_height]
-
-    imgMasked = cv2.bitwise_and(img, img, mask=mask) if mask is not None else img
-    detections = np.empty((0, 5))
-    print("[🔍 DEBUG] Running YOLO inference...")
-    results = model(imgMasked, stream=True)
-
-    for r in results:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            conf = math.ceil((box.conf[0] * 100)) / 100
-            cls = int(box.cls[0])
-            currentClass = model.names[cls]
-            if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:
-                print(f"[📦 DETECTED] {currentClass} at {x1,y1,x2,y2} with {conf}")
-                detections = np.vstack((detections, [x1, y1, x2, y2, conf]))
-
-    print(f"[📌 DEBUG] Updating tracker with {len(detections)} detections...")
-    resultsTracker = tracker.update(detections)
-
-    for result in resultsTracker:
-        x1, y1, x2, y2, id = map(int, result)
-        cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2
-        center = (cx, cy)
-
-        if id not in id_history:
-            id_history[id] = []
-        id_history[id].append(center)
-        if len(id_history[id]) > 15:
-            id_history[id] = id_history[id][-15:]
-
-        if len(id_history[id]) >= 2:
-            x_positions = [pt[0] for pt in id_history[id]]
-            direction = "Right" if x_positions[-1] > x_positions[0] else "Left"
-            crossed = any(
-                (x_positions[i] < COUNT_LINE[0] < x_positions[i + 1]) or
-                (x_positions[i] > COUNT_LINE[0] > x_positions[i + 1])
-                for i in range(len(x_positions) - 1)
-            )
-            distance = abs(x_positions[-1] - x_positions[0])
-            now = time.time()
-            recent = last_count_time.get(id, 0)
-            if crossed and distance > 15 and (now - recent) > COOLDOWN_SECONDS:
-                print(f"[✅ COUNT] Boat ID {id} going {direction}, dist={distance}, time={now}")
-                counted_ids.add(id)
-                last_count_time[id] = now
-                totalCount.append(id)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"boat_{timestamp}.jpg"
-                filepath = os.path.join(SNAPSHOT_DIR, filename)
-                cv2.imwrite(filepath, img)
-                if sheet:
-                    try:
-                        sheet.append_row([
-                            datetime.now().strftime('%Y-%m-%d'),
-                            datetime.now().strftime('%H:%M:%S'),
+        running = False
+        if not frame_buf:
+            break
+
+    masked_buf = [masked for _, masked, moving in frame_buf if moving]
+    print(f"[🔍 DEBUG] Running YOLO inference on {len(masked_buf)}/{len(frame_buf)} frames with motion...")
+    results = iter(model.predict(masked_buf, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD,
+                                 imgsz=IMGSZ, verbose=False, stream=False) if masked_buf else ())
+
+    # SORT is stateful, so frames are replayed strictly in capture order;
+    # idle frames still update the tracker (with no detections) so tracks age out
+    for img, _, moving in frame_buf:
+        boxes = next(results).boxes if moving else None
+        if boxes is None or len(boxes) == 0:
+            detections = np.empty((0, 5), np.float32)
+        else:
+            xyxy = boxes.xyxy.cpu().numpy() + (roi_x0, roi_y0, roi_x0, roi_y0)
+            conf = boxes.conf.cpu().numpy()
+            detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)
+            for x1, y1, x2, y2, c in detections:
+                print(f"[📦 DETECTED] {CLASS_FILTER} at {int(x1), int(y1), int(x2), int(y2)} with {c:.2f}")
+
+        print(f"[📌 DEBUG] Updating tracker with {len(detections)} detections...")
+        resultsTracker = tracker.update(detections)
+
+        now = time.time()
+        frame_count += 1
+        if frame_count % PRUNE_EVERY_FRAMES == 0:
+            prune_stale_ids(now)
+
+        for result in resultsTracker:
+            x1, y1, x2, y2, id = map(int, result)
+            last_seen[id] = now
+            cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2
+            push_center(id, cx, cy)
+
+            direction = "???"
+            if hist_count[id] >= 2:
+                # int32 copy so the offset products below can't overflow int16
+                x_positions = history(id)[0].astype(np.int32)
+                direction = "Right" if x_positions[-1] > x_positions[0] else "Left"
+                # A sign change between consecutive offsets means the line was crossed
+                offsets = x_positions - LINE_X
+                crossed = bool(np.any(offsets[:-1] * offsets[1:] < 0))
+                distance = abs(int(x_positions[-1] - x_positions[0]))
+                recent = last_count_time.get(id, 0)
+                if crossed and distance > 15 and (now - recent) > COOLDOWN_SECONDS:
+                    print(f"[✅ COUNT] Boat ID {id} going {direction}, dist={distance}, time={now}")
+                    counted_ids.add(id)
+                    last_count_time[id] = now
+                    totalCount.append(id)
+                    count_time = datetime.now()
+                    timestamp = count_time.strftime('%Y%m%d_%H%M%S')
+                    filename = f"boat_{timestamp}.jpg"
+                    filepath = os.path.join(SNAPSHOT_DIR, filename)
+                    # Save only the boat (plus a margin) and encode it off the frame loop
+                    crop = img[max(0, y1 - SNAPSHOT_PAD):max(0, y2 + SNAPSHOT_PAD), max(0, x1 - SNAPSHOT_PAD):max(0, x2 + SNAPSHOT_PAD)]
+                    crop = crop.copy() if crop.size else img.copy()
+                    snap_pool.submit(cv2.imwrite, filepath, crop, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_JPEG_QUALITY])
+                    if sheet:
+                        sheet_q.put([
+                            count_time.strftime('%Y-%m-%d'),
+                            count_time.strftime('%H:%M:%S'),
                             len(totalCount),
                             filename,
                             direction
                         ])
-                        print("[📊 LOGGED] Added entry to Google Sheet")
-                    except Exception as e:
-                        print(f"[❌ ERROR] Google Sheets write failed: {e}")
 
-        cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)
-        cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
-        cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)
-        for pt in id_history[id]:
-            cv2.circle(img, pt, 2, (0, 255, 255), -1)
+            if not HEADLESS:
+                cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)
+                cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
+                cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)
+                trail = history(id).T.astype(np.int32).reshape(-1, 1, 2)
+                cv2.polylines(img, [trail], False, (0, 255, 255), 2)
+
+        if HEADLESS:
+            continue
+
+        cv2.line(img, (LINE_X, 0), (LINE_X, frame_height), (0, 0, 255), 2)
+        cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(img, "Press Q to quit", (img.shape[1] - cv2.getTextSize("Press Q to quit", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0][0] - 20, img.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
 
-    cv2.line(img, (COUNT_LINE[0], COUNT_LINE[1]), (COUNT_LINE[2], COUNT_LINE[3]), (0, 0, 255), 2)
-    cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    cv2.putText(img, "Press Q to quit", (img.shape[1] - cv2.getTextSize("Press Q to quit", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0][0] - 20, img.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+        cv2.imshow("Boat Detection Test", img)
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            print("[👋 DEBUG] Q key pressed — exiting...")
+            running = False
+            break
 
-    cv2.imshow("Boat Detection Test", img)
-    if cv2.waitKey(1) & 0xFF == ord("q"):
-        print("[👋 DEBUG] Q key pressed — exiting...")
-        break
+    frame_buf = []
 
 if cap:
     print("[🎬 DEBUG] Releasing video capture...")
     cap.release()
-cv2.destroyAllWindows()
+print("[📁 DEBUG] Waiting for pending snapshots...")
+snap_pool.shutdown(wait=True)
+if sheet_thread:
+    print("[📊 DEBUG] Flushing queued Google Sheet rows...")
+    sheet_q.put(None)
+    sheet_thread.join(timeout=10)
+if not HEADLESS:
+    cv2.destroyAllWindows()
 print(f"[🏁 DONE] Final boat count: {len(totalCount)}")
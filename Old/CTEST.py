@@ -19,10 +19,15 @@ Date: 07/14/2025
 # === IMPORTS SECTION ===
 import cv2  # OpenCV for video processing and GUI
 import numpy as np  # For array and matrix operations
-import math  # For rounding and math functions
 import time  # For timing and delays
 import os  # For file and directory operations
+import threading  # For the background frame grabber
+import signal  # Clean Ctrl+C exit when running headless
+from concurrent.futures import ThreadPoolExecutor  # Off-thread snapshot writes
+from queue import Queue, Full, Empty  # One-slot hand-off between grabber and main loop
+from collections import deque  # Fixed-length centroid history
 from datetime import datetime  # For timestamps
+import torch  # Accelerator detection for the PyTorch fallback
 from ultralytics import YOLO  # YOLOv8 object detection model
 from sort import *  # SORT tracker for object tracking
 import gspread  # Google Sheets API
@@ -33,22 +38,43 @@ import pytz  # For timezone handling
 
 # === CONFIGURATION SECTION ===
 VIDEO_SOURCE = 0  # Path to the input video file = 0 for one on pi "test_boats3.mp4" 
+DISPLAY_WINDOW = False  # True to draw overlays and show the video window (off on the Pi)
+LIVE_SOURCE = isinstance(VIDEO_SOURCE, int)  # Camera index: serve only the newest frame; video file: keep every frame
+PROCESS_FPS = 10  # Frames per second actually decoded for YOLO; the rest are grabbed and skipped (0 = decode all)
 MODEL_PATH = "yolov8n.pt"         # Path to YOLOv8 model file
+EXPORT_PATH = "yolov8n_openvino_model"  # OpenVINO FP16 export of MODEL_PATH (preferred when present)
+IMGSZ = (384, 640)                # Inference size (h, w): 640x360 frames padded to a multiple of 32
 CLASS_FILTER = "boat"             # Only detect and count boats
 CONFIDENCE_THRESHOLD = 0.15        # Minimum confidence for detection
 SNAPSHOT_DIR = "snapshots"        # Directory to save boat snapshots
+SNAPSHOT_JPEG_QUALITY = 85        # JPEG quality for snapshots (smaller, faster encode)
 GSHEET_CREDS_FILE = "gsheets_creds.json"  # Google Sheets service account file
 GOOGLE_SHEET_NAME = "Boat Counter Logs"   # Name of the Google Sheet
 COOLDOWN_SECONDS = 5  # Cooldown per boat ID to prevent duplicates
+STALE_ID_SECONDS = 600  # Forget IDs the tracker hasn't reported for this long
+PRUNE_EVERY_FRAMES = 1000  # How often to sweep stale IDs out of the tracking dicts
+SHEET_BATCH_ROWS = 10  # Send queued Google Sheets rows once this many are waiting...
+SHEET_FLUSH_SECONDS = 5  # ...or once the oldest has waited this long
+SHEET_RETRIES = 3  # Attempts per batch before the rows are dropped
+CV_THREADS = min(4, os.cpu_count() or 1)  # OpenCV worker threads; leaves cores for inference and the grabber
+
+cv2.setUseOptimized(True)  # Make sure the SIMD (NEON/AVX) code paths are on
+cv2.setNumThreads(CV_THREADS)  # Cap OpenCV's pool so it doesn't fight the model for cores
 
 # === LOCATION CONFIG FOR DAYLIGHT-AWARE MODE ===
 CITY = LocationInfo("Colorado Springs", "USA", "MST", 38.8339, -104.8214)  # Set city/location info
 TIMEZONE = pytz.timezone("MST")  # Set timezone
 
-def is_daytime():  # Function to check if it's currently daytime
-    now = datetime.now(TIMEZONE)  # Get current time in timezone
-    s = sun(CITY.observer, date=now.date(), tzinfo=TIMEZONE)  # Get sunrise/sunset times
-    return s["sunrise"] <= now <= s["sunset"]  # Return True if now is between sunrise and sunset
+sun_day = None  # Date the cached sunrise/sunset belong to
+sunrise = sunset = None  # Cached sunrise/sunset for sun_day
+
+def is_daytime(now=None):  # Function to check if it's currently (or at `now`) daytime
+    global sun_day, sunrise, sunset
+    now = now or datetime.now(TIMEZONE)  # Get current time in timezone
+    if now.date() != sun_day:  # Only run the astral calculation once per day
+        s = sun(CITY.observer, date=now.date(), tzinfo=TIMEZONE)  # Get sunrise/sunset times
+        sun_day, sunrise, sunset = now.date(), s["sunrise"], s["sunset"]  # Cache them for the rest of the day
+    return sunrise <= now <= sunset  # Return True if now is between sunrise and sunset
 
 def setup_capture():  # Function to set up video capture
     cap = cv2.VideoCapture(VIDEO_SOURCE)  # Open video file or camera
@@ -56,6 +82,47 @@ def setup_capture():  # Function to set up video capture
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)  # Set height
     return cap  # Return capture object
 
+def frame_skip(cap):  # Number of captured frames per decoded frame
+    fps = cap.get(cv2.CAP_PROP_FPS)  # Source frame rate (0 if the driver doesn't report it)
+    if PROCESS_FPS <= 0 or fps <= 0:  # Skipping disabled or rate unknown
+        return 1
+    return max(1, int(fps / PROCESS_FPS))
+
+class FrameGrabber(threading.Thread):  # Reads frames in the background so decode overlaps YOLO
+    def __init__(self, cap):
+        super().__init__(name="frame-grabber", daemon=True)
+        self.cap = cap  # Capture object owned by this grabber
+        self.q = Queue(maxsize=1)  # Holds the next (success, frame) for the main loop
+        self.skip = frame_skip(cap)  # Decode only every skip-th frame
+        self.running = threading.Event()  # Cleared to stop the thread
+        self.running.set()
+
+    def run(self):
+        while self.running.is_set():
+            for _ in range(self.skip - 1):  # Advance past frames YOLO won't see without decoding them
+                self.cap.grab()
+            item = self.cap.read()  # (success, frame)
+            while self.running.is_set():
+                try:
+                    self.q.put(item, timeout=0.1)  # Hand frame to the main loop
+                    break
+                except Full:
+                    if LIVE_SOURCE:  # Drop the stale frame so the newest is always served
+                        try:
+                            self.q.get_nowait()
+                        except Empty:
+                            pass
+            if not item[0]:  # End of video or camera failure: let the main loop see it and stop
+                return
+
+    def read(self):
+        return self.q.get()  # Wait for the next frame
+
+    def stop(self):
+        self.running.clear()  # Ask the thread to exit
+        self.join(timeout=1)  # Let it finish its current read
+        self.cap.release()  # Release camera
+
 #def shutdown_display():  # Function to turn off display (for Pi)
     #os.system("/usr/bin/tvservice -o")  # Turn off HDMI
     #os.system("vcgencmd display_power 0")  # Power off display
@@ -79,128 +146,217 @@ try:
 except Exception as e:
     print(f"[⚠️ WARN] Google Sheets not connected: {e}")  # Print warning if connection fails
 
+sheet_q = Queue()  # Rows waiting to be appended to the Google Sheet; None stops the writer
+
+def sheet_writer():
+    """Append queued rows to the Google Sheet in batches so network latency stays off the frame loop."""
+    rows = []  # Rows collected for the next append_rows call
+    deadline = None  # When the current batch must be sent
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)  # Wait briefly for the next row
+            if row is None:  # Shutdown: flush what we have and exit
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SECONDS
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            for attempt in range(1, SHEET_RETRIES + 1):
+                try:
+                    sheet.append_rows(rows)  # One HTTPS round-trip for the whole batch
+                    break
+                except Exception as e:
+                    print(f"[❌ ERROR] Google Sheets write failed ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}")  # Print error if logging fails
+                    if attempt < SHEET_RETRIES:
+                        time.sleep(2 ** attempt)  # Back off before retrying
+            rows, deadline = [], None
+
+sheet_thread = None  # Background writer, only started when Sheets is connected
+if sheet:
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
 # === OPTIONAL MASK LOADING ===
 mask = None  # Will hold the binary mask if available
+roi_x0, roi_y0 = 0, 0  # Top-left of the mask's bounding box (added back to YOLO boxes)
 if os.path.exists("mask.png"):  # Check if mask file exists
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)  # Load mask as grayscale
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]  # Ensure mask is binary (0 or 255)
+    ys, xs = np.nonzero(mask)  # Pixels inside the region of interest
+    if ys.size:  # Crop YOLO input to the mask's bounding box
+        roi_y0, roi_y1 = int(ys.min()), int(ys.max()) + 1
+        roi_x0, roi_x1 = int(xs.min()), int(xs.max()) + 1
+    else:  # Empty mask: keep the full frame (everything is masked out anyway)
+        roi_y1, roi_x1 = mask.shape
+    mask_crop = mask[roi_y0:roi_y1, roi_x0:roi_x1]  # Mask restricted to its bounding box
     print("[🧭] Mask loaded successfully.")  # Print success message
 else:
     print("[ℹ️] No mask found – using full frame.")  # Print info if no mask
 
+def apply_mask(frame):
+    """Crop frame to the mask's bounding box and black out pixels outside the mask."""
+    if mask is None:
+        return frame  # No mask: YOLO sees the full frame
+    sub = frame[roi_y0:roi_y1, roi_x0:roi_x1]  # View of the ROI, no copy
+    return cv2.bitwise_and(sub, sub, mask=mask_crop)  # Mask only the ROI pixels
+
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)  # Ensure the snapshot directory exists
+snap_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")  # JPEG encode + disk write off the frame loop
 
-model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+if not os.path.exists(EXPORT_PATH):  # One-time OpenVINO export (needs the openvino package)
+    try:
+        EXPORT_PATH = YOLO(MODEL_PATH).export(format="openvino", half=True, imgsz=IMGSZ)  # Writes the model folder next to the .pt
+        print(f"[⚡] Exported OpenVINO model to {EXPORT_PATH}")  # Print export message
+    except Exception as e:
+        print(f"[ℹ️] OpenVINO export unavailable, using PyTorch weights: {e}")  # Fall back to eager PyTorch
+if os.path.exists(EXPORT_PATH):
+    model = YOLO(EXPORT_PATH, task="detect")  # Load OpenVINO model for detection
+    DEVICE = "cpu"  # OpenVINO runs on the CPU
+else:
+    model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+    DEVICE = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")  # Best available accelerator
+    model.to(DEVICE)  # Move weights once instead of per call
+HALF = DEVICE == "cuda"  # FP16 inference where it's actually faster
+print(f"[🧠] Running YOLO on {DEVICE}{' (FP16)' if HALF else ''}")  # Print device message
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)  # Class index of CLASS_FILTER (resolved once)
+if BOAT_CLASS_ID is None:  # Model was not trained on the class we want to count
+    raise SystemExit(f"[❌ ERROR] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 tracker = Sort(max_age=30, min_hits=3, iou_threshold=0.4)  # Initialize object tracker
 
 # === TRACKING VARIABLES ===
 totalCount = []      # List of unique counted boat IDs
 counted_ids = set()  # Set of IDs that have already been counted (prevents double-counting)
-id_history = {}      # Dictionary to store the last N centroids for each ID
+id_history = {}      # Dictionary of deques holding the last N centroids for each ID
 last_count_time = {} # Dictionary to store the last count time for each ID
+last_seen = {}       # Dictionary to store when each ID was last tracked
+frame_count = 0      # Frames processed, drives the periodic stale-ID sweep
 
-print("[🎥] Starting boat detection test. Press 'Q' to exit.")  # Print start message
+def prune_stale_ids(now):
+    """Drop per-ID state for tracks unseen for STALE_ID_SECONDS so multi-day runs don't leak memory."""
+    stale = [k for k, t in last_seen.items() if now - t > STALE_ID_SECONDS]
+    for k in stale:
+        id_history.pop(k, None)
+        last_count_time.pop(k, None)
+        last_seen.pop(k, None)
+        counted_ids.discard(k)
+
+print(f"[🎥] Starting boat detection test. Press {'Q' if DISPLAY_WINDOW else 'Ctrl+C'} to exit.")  # Print start message
 
 # === MAIN LOOP WITH SLEEP SUPPORT ===
 last_checked_day = None  # Track last day checked for sunrise/sunset
-cap = None  # Video capture object
-frame_width, frame_height = 640, 360  # Default frame size
-line_x = frame_width // 2  # Place the line at 1/2 of the frame width
-COUNT_LINE = [line_x, 0, line_x, frame_height]  # Vertical red line from top to bottom
+grabber = None  # Background frame grabber (owns the video capture)
+COUNT_LINE = None  # Vertical red line [x, 0, x, height]; set from the first frame after the camera opens
+running = True  # Cleared by Q or SIGINT to leave the main loop
+
+def request_stop(signum, frame):  # SIGINT handler: finish the current frame, then clean up
+    global running
+    print("[👋] Ctrl+C received — exiting...")  # Print exit message
+    running = False
 
-while True:  # Main loop
-    current_day = datetime.now(TIMEZONE).date()  # Get current date
+if not DISPLAY_WINDOW:  # No window to press Q in
+    signal.signal(signal.SIGINT, request_stop)
+
+while running:  # Main loop
+    now_mono = time.time()  # One clock read per frame, reused below
+    now_tz = datetime.fromtimestamp(now_mono, TIMEZONE)  # Site time for the daylight check
+    now_local = datetime.fromtimestamp(now_mono)  # Local time for filenames and sheet rows
+    current_day = now_tz.date()  # Get current date
     if current_day != last_checked_day:  # If new day, check sunrise/sunset
         print(f"[📆] Checking sunrise/sunset for {current_day}")  # Print check message
         last_checked_day = current_day  # Update last checked day
 
-    if not is_daytime():  # If it's not daytime
-        print(f"[🌙] Entering sleep mode. Turning off display and camera... ({datetime.now(TIMEZONE).strftime('%H:%M:%S')})")  # Print sleep message
-        if cap:  # If capture is open
-            cap.release()  # Release camera
-            cap = None  # Set to None
-        cv2.destroyAllWindows()  # Close all OpenCV windows
+    if not is_daytime(now_tz):  # If it's not daytime
+        print(f"[🌙] Entering sleep mode. Turning off display and camera... ({now_tz.strftime('%H:%M:%S')})")  # Print sleep message
+        if grabber:  # If capture is open
+            grabber.stop()  # Stop grabbing and release camera
+            grabber = None  # Set to None
+        if DISPLAY_WINDOW:
+            cv2.destroyAllWindows()  # Close all OpenCV windows
         #shutdown_display()  # Turn off display
-        time.sleep(300)  # Sleep for 5 minutes
+        for _ in range(300):  # Sleep for 5 minutes, in 1 s steps so Ctrl+C isn't delayed
+            if not running:
+                break
+            time.sleep(1)
         continue  # Skip to next loop
 
-    if cap is None:  # If camera is not open
-        print(f"[🌞] Waking up and reinitializing camera... ({datetime.now(TIMEZONE).strftime('%H:%M:%S')})")  # Print wake message
+    if grabber is None:  # If camera is not open
+        print(f"[🌞] Waking up and reinitializing camera... ({now_tz.strftime('%H:%M:%S')})")  # Print wake message
         #wake_display()  # Turn on display
-        cap = setup_capture()  # Set up camera
+        grabber = FrameGrabber(setup_capture())  # Set up camera
+        grabber.start()  # Start reading frames in the background
+        COUNT_LINE = None  # Re-measure the frame in case the camera resolution changed
 
-    success, img = cap.read()  # Read a frame from the video
+    success, img = grabber.read()  # Get the next frame from the grabber
     if not success:
         print("[✅] Finished processing video.")
         break
 
-    # Ensure accurate center for current resolution
-    frame_height, frame_width = img.shape[:2]
-    line_x = frame_width // 2
-    COUNT_LINE = [line_x, 0, line_x, frame_height]
-
-    imgMasked = cv2.bitwise_and(img, img, mask=mask) if mask is not None else img  # Apply mask if available
-    detections = np.empty((0, 5))  # Prepare empty array for detections
-    results = model(imgMasked, stream=True)  # Run YOLO on the frame
-    for r in results:  # Loop over detection results
-        for box in r.boxes:  # Loop over detected boxes
-            x1, y1, x2, y2 = map(int, box.xyxy[0])  # Extract bounding box coordinates
-            conf = math.ceil((box.conf[0] * 100)) / 100  # Round confidence
-            cls = int(box.cls[0])  # Get class index
-            currentClass = model.names[cls]  # Get class name
-            if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:  # Filter by class and confidence
-                detections = np.vstack((detections, [x1, y1, x2, y2, conf]))  # Add detection to array
+    if COUNT_LINE is None:  # First frame from this camera: place the line at 1/2 of the frame width
+        frame_height, frame_width = img.shape[:2]
+        line_x = frame_width // 2
+        COUNT_LINE = [line_x, 0, line_x, frame_height]
+
+    imgMasked = apply_mask(img)  # Apply mask if available (cropped to its bounding box)
+    detections = np.empty((0, 5), np.float32)  # Prepare empty array for detections
+    results = model(imgMasked, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD, imgsz=IMGSZ, device=DEVICE, half=HALF, verbose=False, stream=True)  # Run YOLO on the frame, boats only
+    for r in results:  # Loop over detection results (one per frame)
+        xyxy = r.boxes.xyxy.cpu().numpy() + (roi_x0, roi_y0, roi_x0, roi_y0)  # All bounding boxes in one copy, shifted to full-frame coordinates
+        conf = r.boxes.conf.cpu().numpy()  # All confidences
+        detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)  # Rows of [x1, y1, x2, y2, conf], already class/conf filtered
 
     resultsTracker = tracker.update(detections)  # Track detected objects
-    for result in resultsTracker:  # Loop over tracked objects
-        x1, y1, x2, y2, id = map(int, result)  # Get bounding box and ID
-        cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2  # Center of the box
+    frame_count += 1
+    if frame_count % PRUNE_EVERY_FRAMES == 0:  # Periodically forget IDs that left the scene
+        prune_stale_ids(now_mono)
+    tracks = resultsTracker.astype(np.int32)  # Boxes and IDs of all tracks as ints in one pass
+    centers_x = (tracks[:, 0] + tracks[:, 2]) >> 1  # Box centers for every track at once
+    centers_y = (tracks[:, 1] + tracks[:, 3]) >> 1
+    for (x1, y1, x2, y2, id), cx, cy in zip(tracks.tolist(), centers_x.tolist(), centers_y.tolist()):  # Loop over tracked objects
+        last_seen[id] = now_mono  # Track is still alive
         center = (cx, cy)  # Store center as tuple
 
-        if id not in id_history:  # If ID not in history, initialize list
-            id_history[id] = []
-        id_history[id].append(center)  # Add current center to history
-        if len(id_history[id]) > 15:  # Keep only last 15 points
-            id_history[id] = id_history[id][-15:]
+        if id not in id_history:  # If ID not in history, keep only the last 15 points
+            id_history[id] = deque(maxlen=15)
+        id_history[id].append(center)  # Add current center to history (oldest drops off)
 
         if len(id_history[id]) >= 2:  # If enough history to check movement
-            x_positions = [pt[0] for pt in id_history[id]]  # Get all x positions
+            x_positions = np.fromiter((pt[0] for pt in id_history[id]), np.int32, count=len(id_history[id]))  # Get all x positions
             direction = "Right" if x_positions[-1] > x_positions[0] else "Left"  # Determine direction
-            crossed = any(  # Check if the line was crossed in either direction
-                (x_positions[i] < COUNT_LINE[0] < x_positions[i + 1]) or
-                (x_positions[i] > COUNT_LINE[0] > x_positions[i + 1])
-                for i in range(len(x_positions) - 1)
-            )
-            distance = abs(x_positions[-1] - x_positions[0])  # Distance moved
-            now = time.time()  # Get current time
+            offsets = x_positions - COUNT_LINE[0]  # Signed distance of each point from the line
+            crossed = bool(np.any(offsets[:-1] * offsets[1:] < 0))  # Sign change between consecutive points = line crossed
+            distance = abs(int(x_positions[-1] - x_positions[0]))  # Distance moved
             recent = last_count_time.get(id, 0)  # Get last count time for this ID
-            if crossed and distance > 15 and (now - recent) > COOLDOWN_SECONDS:  # If crossed, moved enough, and cooldown passed
+            if crossed and distance > 15 and (now_mono - recent) > COOLDOWN_SECONDS:  # If crossed, moved enough, and cooldown passed
                 counted_ids.add(id)  # Mark as counted
-                last_count_time[id] = now  # Update last count time
+                last_count_time[id] = now_mono  # Update last count time
                 totalCount.append(id)  # Add to total count
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')  # Get timestamp
+                timestamp = now_local.strftime('%Y%m%d_%H%M%S')  # Get timestamp
                 print(f"[✅] Boat #{id} counted at {timestamp} going {direction}")  # Print count message
                 filename = f"boat_{timestamp}.jpg"  # Filename for snapshot
                 filepath = os.path.join(SNAPSHOT_DIR, filename)  # Full path
-                cv2.imwrite(filepath, img)  # Save the frame as an image
-                if sheet:  # If Google Sheets is connected
-                    try:
-                        sheet.append_row([
-                            datetime.now().strftime('%Y-%m-%d'),  # Date
-                            datetime.now().strftime('%H:%M:%S'),  # Time
-                            len(totalCount),                      # Total count
-                            filename,                             # Image filename
-                            direction                             # Direction
-                        ])
-                    except Exception as e:
-                        print(f"[❌ ERROR] Google Sheets write failed: {e}")  # Print error if logging fails
-
-        direction = "Right" if id_history[id][-1][0] > id_history[id][0][0] else "Left"  # Determine direction for drawing
-        cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)  # Draw bounding box
-        cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)  # Draw ID and direction
-        cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)  # Draw center point
-        for pt in id_history[id]:
-            cv2.circle(img, pt, 2, (0, 255, 255), -1)  # Draw trajectory
+                snap_pool.submit(cv2.imwrite, filepath, img.copy(), [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_JPEG_QUALITY])  # Save a copy in the background (later drawing can't touch it)
+                if sheet:  # If Google Sheets is connected, hand the row to the background writer
+                    sheet_q.put([
+                        now_local.strftime('%Y-%m-%d'),  # Date
+                        now_local.strftime('%H:%M:%S'),  # Time
+                        len(totalCount),                 # Total count
+                        filename,                        # Image filename
+                        direction                        # Direction
+                    ])
+
+        if DISPLAY_WINDOW:  # Draw visualizations (only if display is enabled)
+            direction = "Right" if id_history[id][-1][0] > id_history[id][0][0] else "Left"  # Determine direction for drawing
+            cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)  # Draw bounding box
+            cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)  # Draw ID and direction
+            cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)  # Draw center point
+            trail = np.array(id_history[id], dtype=np.int32).reshape(-1, 1, 2)  # History as an OpenCV point list
+            cv2.polylines(img, [trail], False, (0, 255, 255), 2)  # Draw trajectory in one call
+
+    if not DISPLAY_WINDOW:  # Headless: nothing to draw or show
+        continue
 
     cv2.line(img, (COUNT_LINE[0], COUNT_LINE[1]), (COUNT_LINE[2], COUNT_LINE[3]), (0, 0, 255), 2)  # Draw counting line
     cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)  # Draw total count
@@ -210,7 +366,12 @@ while True:  # Main loop
     if cv2.waitKey(1) & 0xFF == ord("q"):  # Wait for 'q' key to quit
         break
 
-if cap:  # If capture is open
-    cap.release()  # Release the video capture
-cv2.destroyAllWindows()  # Close all OpenCV windows
+if grabber:  # If capture is open
+    grabber.stop()  # Stop the grabber and release the video capture
+snap_pool.shutdown(wait=True)  # Finish writing pending snapshots
+if sheet_thread:
+    sheet_q.put(None)  # Ask the writer to flush remaining rows
+    sheet_thread.join(timeout=30)  # Give the final append (and its retries) a chance to finish
+if DISPLAY_WINDOW:
+    cv2.destroyAllWindows()  # Close all OpenCV windows
 print(f"[🏁 DONE] Final boat count: {len(totalCount)}")  # Print final count
@@ -18,10 +18,15 @@ Date: 07/09/2025
 # === IMPORTS SECTION ===
 import cv2  # For video frame processing and GUI
 import numpy as np  # For working with arrays and matrices
-import math  # For rounding and mathematical operations
 import time  # For timing intervals
 import os  # For file system access
+import threading  # For the Google Sheets writer thread
+import signal  # Clean Ctrl+C exit when running headless
+from concurrent.futures import ThreadPoolExecutor  # Snapshot writes off the frame loop
+from queue import Queue, Empty  # Rows handed from the frame loop to the writer
+from collections import deque  # Fixed-length centroid history
 from datetime import datetime  # For timestamps
+import torch  # Accelerator detection for the PyTorch fallback
 from ultralytics import YOLO  # YOLOv8 object detection model
 from sort import *  # SORT = Simple Online and Realtime Tracking
 import gspread  # Google Sheets Python API
@@ -30,11 +35,25 @@ from google.oauth2.service_account import Credentials  # Google auth with servic
 # === CONFIGURATION SECTION ===
 VIDEO_SOURCE = "test_boats4.mp4"
 MODEL_PATH = "yolov8n.pt"
+EXPORT_PATH = "yolov8n_openvino_model"  # OpenVINO FP16 export of MODEL_PATH, used when present
+IMGSZ = (384, 640)  # inference (h, w) matching the 640x360 capture, padded to a multiple of 32
 CLASS_FILTER = "boat"
 CONFIDENCE_THRESHOLD = 0.3
+DISPLAY_WINDOW = False  # True to draw overlays and show the video window
+PROCESS_FPS = 10  # frames/s decoded for YOLO; others are grab()bed and skipped (0 = decode all)
 SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_JPEG_QUALITY = 85
 GSHEET_CREDS_FILE = "gsheets_creds.json"
 GOOGLE_SHEET_NAME = "Boat Counter Logs"
+SHEET_BATCH_ROWS = 10  # flush queued sheet rows at this many...
+SHEET_FLUSH_SECONDS = 5  # ...or after this many seconds
+SHEET_RETRIES = 3
+STALE_ID_SECONDS = 600  # forget IDs the tracker hasn't reported for this long...
+PRUNE_EVERY_FRAMES = 1000  # ...checked every this many frames
+CV_THREADS = min(4, os.cpu_count() or 1)  # OpenCV pool size; leaves cores for inference
+
+cv2.setUseOptimized(True)
+cv2.setNumThreads(CV_THREADS)
 
 # === SETUP GOOGLE SHEETS CONNECTION ===
 sheet = None
@@ -51,16 +70,66 @@ try:
 except Exception as e:
     print(f"[⚠️ WARN] Google Sheets not connected: {e}")
 
+# Rows are appended in batches from a background thread; None tells it to flush and exit
+sheet_q = Queue()
+
+def sheet_writer():
+    rows = []
+    deadline = None
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)
+            if row is None:
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SECONDS
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            for attempt in range(1, SHEET_RETRIES + 1):
+                try:
+                    sheet.append_rows(rows)
+                    break
+                except Exception as e:
+                    print(f"[❌ ERROR] Google Sheets write failed ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}")
+                    if attempt < SHEET_RETRIES:
+                        time.sleep(2 ** attempt)
+            rows, deadline = [], None
+
+sheet_thread = None
+if sheet:
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
 # === OPTIONAL MASK LOADING ===
 mask = None
+roi_x0, roi_y0 = 0, 0  # top-left of the mask's bounding box, added back to YOLO boxes
 if os.path.exists("mask.png"):
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+    # YOLO only needs to see the mask's bounding box
+    ys, xs = np.nonzero(mask)
+    if ys.size:
+        roi_y0, roi_y1 = int(ys.min()), int(ys.max()) + 1
+        roi_x0, roi_x1 = int(xs.min()), int(xs.max()) + 1
+    else:
+        roi_y1, roi_x1 = mask.shape
+    mask_crop = mask[roi_y0:roi_y1, roi_x0:roi_x1]
     print("[🧭] Mask loaded successfully.")
 else:
     print("[ℹ️] No mask found – using full frame.")
 
+def apply_mask(frame):
+    """Crop frame to the mask's bounding box and black out pixels outside the mask."""
+    if mask is None:
+        return frame
+    sub = frame[roi_y0:roi_y1, roi_x0:roi_x1]
+    return cv2.bitwise_and(sub, sub, mask=mask_crop)
+
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+snap_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
 
 # === LOAD VIDEO AND MODEL ===
 cap = cv2.VideoCapture(VIDEO_SOURCE)
@@ -71,58 +140,100 @@ frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 line_x = frame_width // 4
 COUNT_LINE = [line_x, 0, line_x, frame_height]
+capture_fps = cap.get(cv2.CAP_PROP_FPS)
+FRAME_SKIP = max(1, int(capture_fps / PROCESS_FPS)) if PROCESS_FPS > 0 and capture_fps > 0 else 1
 
-model = YOLO(MODEL_PATH)
+if not os.path.exists(EXPORT_PATH):
+    try:
+        EXPORT_PATH = YOLO(MODEL_PATH).export(format="openvino", half=True, imgsz=IMGSZ)
+        print(f"[⚡] Exported OpenVINO model to {EXPORT_PATH}")
+    except Exception as e:
+        print(f"[ℹ️] OpenVINO export unavailable, using PyTorch weights: {e}")
+if os.path.exists(EXPORT_PATH):
+    model = YOLO(EXPORT_PATH, task="detect")
+    DEVICE = "cpu"  # OpenVINO runs on the CPU
+else:
+    model = YOLO(MODEL_PATH)
+    DEVICE = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+    model.to(DEVICE)
+HALF = DEVICE == "cuda"
+print(f"[🧠] Running YOLO on {DEVICE}{' (FP16)' if HALF else ''}")
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"[❌ ERROR] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 tracker = Sort(max_age=30, min_hits=5, iou_threshold=0.5)
 
 totalCount = []
 counted_ids = set()
-id_history = {}  # Track recent centroids
+id_history = {}  # Track recent centroid x positions (only x is needed to test the vertical line)
+last_seen = {}
+frame_count = 0
+
+def prune_stale_ids(now):
+    """Drop per-ID state for tracks unseen for STALE_ID_SECONDS so long runs don't leak memory."""
+    stale = [k for k, t in last_seen.items() if now - t > STALE_ID_SECONDS]
+    for k in stale:
+        id_history.pop(k, None)
+        last_seen.pop(k, None)
+        counted_ids.discard(k)
 
-print("[🎥] Starting boat detection test. Press 'Q' to exit.")
+print(f"[🎥] Starting boat detection test. Press {'Q' if DISPLAY_WINDOW else 'Ctrl+C'} to exit.")
+
+running = True
+
+def request_stop(signum, frame):
+    global running
+    print("[👋] Ctrl+C received — exiting...")
+    running = False
+
+if not DISPLAY_WINDOW:
+    # No window to press Q in; finish the current frame, then flush snapshots and sheet rows
+    signal.signal(signal.SIGINT, request_stop)
 
 # === MAIN LOOP ===
-while True:
+while running:
+    # grab() only demuxes; skipped frames never pay for decode + colour conversion
+    for _ in range(FRAME_SKIP - 1):
+        cap.grab()
     success, img = cap.read()
     if not success:
         print("[✅] Finished processing video.")
         break
 
-    imgMasked = cv2.bitwise_and(img, img, mask=mask) if mask is not None else img
+    imgMasked = apply_mask(img)
 
     # === OBJECT DETECTION ===
-    detections = np.empty((0, 5))
-    results = model(imgMasked, stream=True)
+    detections = np.empty((0, 5), np.float32)
+    # Class and confidence filtering happen inside YOLO's NMS
+    results = model(imgMasked, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD, imgsz=IMGSZ, device=DEVICE, half=HALF,
+                    verbose=False, stream=True)
     for r in results:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            conf = math.ceil((box.conf[0] * 100)) / 100
-            cls = int(box.cls[0])
-            currentClass = model.names[cls]
-            if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:
-                detections = np.vstack((detections, [x1, y1, x2, y2, conf]))
+        xyxy = r.boxes.xyxy.cpu().numpy() + (roi_x0, roi_y0, roi_x0, roi_y0)
+        conf = r.boxes.conf.cpu().numpy()
+        detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)
 
     # === OBJECT TRACKING ===
     resultsTracker = tracker.update(detections)
-    for result in resultsTracker:
-        x1, y1, x2, y2, id = map(int, result)
-        cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2
-        center = (cx, cy)
+    now = time.time()
+    frame_count += 1
+    if frame_count % PRUNE_EVERY_FRAMES == 0:
+        prune_stale_ids(now)
+    # Convert and compute centers for all tracks at once; the loop only sees plain ints
+    tracks = resultsTracker.astype(np.int32)
+    centers_x = (tracks[:, 0] + tracks[:, 2]) >> 1
+    centers_y = (tracks[:, 1] + tracks[:, 3]) >> 1
+    for (x1, y1, x2, y2, id), cx, cy in zip(tracks.tolist(), centers_x.tolist(), centers_y.tolist()):
+        last_seen[id] = now
 
         if id not in id_history:
-            id_history[id] = []
-        id_history[id].append(center)
-
-        if len(id_history[id]) > 10:
-            id_history[id] = id_history[id][-10:]
+            id_history[id] = deque(maxlen=10)
+        id_history[id].append(cx)
 
         if len(id_history[id]) >= 2:
-            x_positions = [pt[0] for pt in id_history[id]]
-            crossed = any(
-                (x_positions[i] < COUNT_LINE[0] < x_positions[i + 1]) or
-                (x_positions[i] > COUNT_LINE[0] > x_positions[i + 1])
-                for i in range(len(x_positions) - 1)
-            )
+            x_positions = np.fromiter(id_history[id], np.int32, count=len(id_history[id]))
+            # A sign change between consecutive offsets means the line was crossed
+            offsets = x_positions - COUNT_LINE[0]
+            crossed = bool(np.any(offsets[:-1] * offsets[1:] < 0))
             if crossed and id not in counted_ids:
                 counted_ids.add(id)
                 totalCount.append(id)
@@ -130,22 +241,24 @@ while True:
                 print(f"[✅] Boat #{id} counted at {timestamp}")
                 filename = f"boat_{timestamp}.jpg"
                 filepath = os.path.join(SNAPSHOT_DIR, filename)
-                cv2.imwrite(filepath, img)
+                # Copy so the boxes drawn later this frame don't end up in the snapshot
+                snap_pool.submit(cv2.imwrite, filepath, img.copy(), [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_JPEG_QUALITY])
                 if sheet:
-                    now = datetime.now()
-                    try:
-                        sheet.append_row([
-                            now.strftime('%Y-%m-%d'),
-                            now.strftime('%H:%M:%S'),
-                            len(totalCount),
-                            filename
-                        ])
-                    except Exception as e:
-                        print(f"[❌ ERROR] Google Sheets write failed: {e}")
-
-        cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)
-        cv2.putText(img, f"ID: {id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
-        cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)
+                    now_dt = datetime.now()  # not `now`: that's the float clock last_seen uses
+                    sheet_q.put([
+                        now_dt.strftime('%Y-%m-%d'),
+                        now_dt.strftime('%H:%M:%S'),
+                        len(totalCount),
+                        filename
+                    ])
+
+        if DISPLAY_WINDOW:
+            cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)
+            cv2.putText(img, f"ID: {id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
+            cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)
+
+    if not DISPLAY_WINDOW:
+        continue
 
     cv2.line(img, (COUNT_LINE[0], COUNT_LINE[1]), (COUNT_LINE[2], COUNT_LINE[3]), (0, 0, 255), 2)
     cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
@@ -156,5 +269,10 @@ while True:
         break
 
 cap.release()
-cv2.destroyAllWindows()
+snap_pool.shutdown(wait=True)
+if sheet_thread:
+    sheet_q.put(None)
+    sheet_thread.join(timeout=30)
+if DISPLAY_WINDOW:
+    cv2.destroyAllWindows()
 print(f"[🏁 DONE] Final boat count: {len(totalCount)}")
@@ -17,15 +17,21 @@ from __future__ import annotations
 # ───────────────────────── Imports ─────────────────────────
 import logging
 from logging.handlers import RotatingFileHandler
+import os
+import queue
 import sys
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 from pathlib import Path
 from typing import Optional, Dict, Tuple, List
 
 import cv2
 import numpy as np
+import torch
 from ultralytics import YOLO
 
 try:
@@ -42,15 +48,31 @@ try:
 except ImportError:
     gspread = None
 
+try:
+    from numba import njit                   # JIT for the crossing check; optional
+except ImportError:
+    def njit(*args, **kwargs):               # no numba: run the same NumPy code uncompiled
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
 # ───────────────────────── Config ──────────────────────────
 TZ                = ZoneInfo("America/Denver")
 MODEL_PATH        = "yolov8n.pt"          # nano model is lightest
+EXPORT_PATH       = Path("yolov8n_int8_openvino_model")  # INT8 OpenVINO export, preferred when present
+INT8_CALIB_DATA   = "coco128.yaml"        # calibration set; point at boat footage for best accuracy
+CLASS_FILTER      = "boat"                # COCO class 8 in the stock weights
 VIDEO_SOURCE      = 0                     # camera index or video file
 FRAME_W, FRAME_H  = 640, 360
+IMGSZ             = (-(-FRAME_H // 32) * 32, -(-FRAME_W // 32) * 32)   # inference (h, w): frame rounded up to /32
 COUNT_LINE_RATIO  = 0.5                   # 50 % of width
 CONF_THRESHOLD    = 0.35
 COOLDOWN_SEC      = 5                     # per‑ID throttle
+PROCESS_FPS       = 10                    # frames/s decoded for YOLO; rest are grab()bed (0 = all)
+STALE_ID_SEC      = 600                   # forget track IDs unseen this long…
+PRUNE_EVERY       = 1000                  # …checked every this many frames
 SNAPSHOT_DIR      = Path("snapshots")
+SNAPSHOT_QUALITY  = 85                    # JPEG quality (smaller files, faster encode)
 LOG_DIR           = Path("logs")
 GSHEET_JSON       = "gsheets_creds.json"
 GSHEET_NAME       = "Boat Counter Logs"
@@ -58,6 +80,13 @@ MASK_PATH         = "mask.png"            # optional binary mask
 DISPLAY_WINDOW    = False                 # True to view on HDMI
 MAX_CAMERA_RETRY  = 5
 RETRY_BACKOFF_SEC = 2
+SHEET_BATCH_ROWS  = 10                    # flush queued sheet rows at this many…
+SHEET_FLUSH_SEC   = 5                     # …or once the oldest has waited this long
+SHEET_RETRIES     = 3
+CV_THREADS        = min(4, os.cpu_count() or 1)   # OpenCV pool; leaves cores for inference
+
+cv2.setUseOptimized(True)                 # SIMD (NEON/AVX) kernels
+cv2.setNumThreads(CV_THREADS)
 
 # Ensure directories exist before logger setup
 for d in (SNAPSHOT_DIR, LOG_DIR):
@@ -92,14 +121,24 @@ except ImportError:
 # ──────────── Sunrise / Sunset helper ─────────────
 _city = astral.LocationInfo(latitude=38.833, longitude=-104.821, timezone=str(TZ))
 
+_sun_day: Optional[date] = None
+_dawn: Optional[datetime] = None
+_dusk: Optional[datetime] = None
+
 def is_daytime(ts: Optional[datetime] = None) -> bool:
+    """True between dawn and dusk; astral is only consulted once per day."""
+    global _sun_day, _dawn, _dusk
     ts = ts or datetime.now(TZ)
-    sun = astral_sun.sun(_city.observer, date=ts.date(), tzinfo=TZ)
-    return sun["dawn"] <= ts <= sun["dusk"]
+    if ts.date() != _sun_day:
+        sun = astral_sun.sun(_city.observer, date=ts.date(), tzinfo=TZ)
+        _sun_day, _dawn, _dusk = ts.date(), sun["dawn"], sun["dusk"]
+    return _dawn <= ts <= _dusk
 
 # ───────────── Google Sheets (optional) ────────────
 
-def _init_sheet():
+@lru_cache(maxsize=1)
+def get_sheet():
+    """Authorize and open the log sheet on first use; None if Sheets is unavailable."""
     if gspread is None:
         log.warning("gspread not installed — Sheets logging disabled")
         return None
@@ -114,15 +153,20 @@ def _init_sheet():
         log.warning(f"Google Sheets disabled: {e}")
         return None
 
-sheet = _init_sheet()
-
 # ───────────────────── Camera Wrapper ─────────────────────
 class Camera:
     def __init__(self, source=VIDEO_SOURCE):
         self.source = source
         self.picam2 = None
         self.cap: Optional[cv2.VideoCapture] = None
+        self.skip = 1
         self._open()
+        # Decode on a background thread so capture overlaps inference
+        self._q: queue.Queue = queue.Queue(maxsize=1)
+        self._running = threading.Event()
+        self._running.set()
+        self._thread = threading.Thread(target=self._grab_loop, name="camera-grabber", daemon=True)
+        self._thread.start()
 
     def _open(self):
         retry = 0
@@ -140,6 +184,9 @@ class Camera:
                 self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_H)
                 if not self.cap.isOpened():
                     raise RuntimeError("cv2.VideoCapture failed")
+                fps = self.cap.get(cv2.CAP_PROP_FPS)
+                if PROCESS_FPS > 0 and fps > 0:
+                    self.skip = max(1, int(fps / PROCESS_FPS))
                 log.info("OpenCV camera started")
                 return
             except Exception as e:
@@ -148,57 +195,229 @@ class Camera:
                 time.sleep(RETRY_BACKOFF_SEC ** retry)
         raise RuntimeError("Camera could not be opened after retries")
 
-    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+    def _read_raw(self) -> Tuple[bool, Optional[np.ndarray]]:
         if self.picam2 is not None:
             return True, self.picam2.capture_array()
         assert self.cap is not None
+        for _ in range(self.skip - 1):   # skip frames YOLO won't see without decoding them
+            self.cap.grab()
         return self.cap.read()
 
+    def _grab_loop(self):
+        live = isinstance(self.source, int)
+        while self._running.is_set():
+            item = self._read_raw()
+            while self._running.is_set():
+                try:
+                    self._q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    if not live:
+                        continue
+                    try:                     # live camera: drop the stale frame, serve the newest
+                        self._q.get_nowait()
+                    except queue.Empty:
+                        pass
+            if not item[0]:
+                time.sleep(0.1)              # don't spin on a failing device
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        try:
+            return self._q.get(timeout=1.0)
+        except queue.Empty:
+            return False, None
+
     def release(self):
+        self._running.clear()
+        self._thread.join(timeout=1)
         if self.picam2:
             self.picam2.stop()
         if self.cap:
             self.cap.release()
 
 # ───────────────────── ROI Mask load ─────────────────────
-MASK: Optional[np.ndarray]
-if Path(MASK_PATH).exists():
-    _mask = cv2.imread(MASK_PATH, cv2.IMREAD_GRAYSCALE)
-    MASK = cv2.threshold(_mask, 127, 255, cv2.THRESH_BINARY)[1]
-    log.info("Mask loaded")
-else:
-    MASK = None
-    log.info("No mask — using full frame")
+@lru_cache(maxsize=1)
+def get_mask() -> Tuple[Optional[np.ndarray], Tuple[int, int, int, int]]:
+    """Mask cropped to its bounding box, and that box as (x0, y0, x1, y1); (None, zeros) without a mask."""
+    if not Path(MASK_PATH).exists():
+        log.info("No mask — using full frame")
+        return None, (0, 0, 0, 0)
+    mask = cv2.imread(MASK_PATH, cv2.IMREAD_GRAYSCALE)
+    mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+    ys, xs = np.nonzero(mask)
+    if ys.size:
+        roi = (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+    else:
+        roi = (0, 0, mask.shape[1], mask.shape[0])
+    log.info(f"Mask loaded — YOLO sees ROI {roi}")
+    return mask[roi[1]:roi[3], roi[0]:roi[2]], roi
+
+
+def apply_mask(frame: np.ndarray, mask: Optional[np.ndarray], roi: Tuple[int, int, int, int]) -> np.ndarray:
+    """Crop to the mask's bounding box and black out pixels outside it."""
+    if mask is None:
+        return frame
+    x0, y0, x1, y1 = roi
+    sub = frame[y0:y1, x0:x1]
+    return cv2.bitwise_and(sub, sub, mask=mask)
 
 # ─────────────── YOLO & Tracker init ───────────────
-log.info("Loading YOLOv8 model…")
-model = YOLO(MODEL_PATH)
-tracker = Sort(max_age=15, min_hits=3, iou_threshold=0.1)
+@lru_cache(maxsize=1)
+def get_model() -> Tuple[YOLO, str]:
+    """Load the INT8 OpenVINO export of MODEL_PATH, quantizing on first run; fall back to PyTorch.
+
+    Returns the model and the device to run it on. Loaded once, on first call.
+    """
+    path = EXPORT_PATH
+    if not path.exists():
+        try:
+            log.info(f"Quantizing {MODEL_PATH} to INT8 OpenVINO (one-time, calibrating on {INT8_CALIB_DATA})…")
+            path = Path(YOLO(MODEL_PATH).export(format="openvino", int8=True, data=INT8_CALIB_DATA, imgsz=IMGSZ))
+        except Exception as e:
+            log.warning(f"INT8 export unavailable — using PyTorch weights: {e}")
+    if path.exists():
+        log.info(f"Loading YOLOv8 model from {path}…")
+        return YOLO(str(path), task="detect"), "cpu"
+    device = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+    log.info(f"Loading YOLOv8 model on {device}…")
+    m = YOLO(MODEL_PATH)
+    m.to(device)
+    return m, device
+
+
+def boat_class_id(model: YOLO) -> int:
+    cid = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+    if cid is None:
+        raise SystemExit(f"Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
+    return cid
 
 # ───────────────── Snapshot & Sheets helpers ─────────────────
 
+_snap_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
+
+
+def _write_snapshot(path: Path, frame: np.ndarray):
+    if cv2.imwrite(str(path), frame, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY]):
+        log.debug(f"Snapshot saved {path.name}")
+    else:
+        log.error(f"Snapshot write failed {path.name}")
+
+
 def save_snapshot(frame: np.ndarray, tid: int):
+    if frame.size == 0:
+        log.warning(f"Empty crop for track ID {tid} — snapshot skipped")
+        return
     ts = datetime.now(TZ).strftime("%Y%m%d_%H%M%S_%f")
     path = SNAPSHOT_DIR / f"boat_{tid}_{ts}.jpg"
-    cv2.imwrite(str(path), frame)
-    log.debug(f"Snapshot saved {path.name}")
+    # The crop is a view into the live frame, so hand the encoder its own copy
+    _snap_pool.submit(_write_snapshot, path, frame.copy())
+
+
+_sheet_q: queue.Queue = queue.Queue()      # rows for the writer thread; None = flush and exit
+
+
+def _sheet_worker(sheet):
+    """Append queued rows in batches so Sheets round-trips never block the frame loop."""
+    rows: list = []
+    deadline = 0.0
+    stop = False
+    while not stop:
+        try:
+            row = _sheet_q.get(timeout=0.5)
+            if row is None:
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SEC
+        except queue.Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            for attempt in range(1, SHEET_RETRIES + 1):
+                try:
+                    sheet.append_rows(rows)
+                    log.debug(f"Sheets appended {len(rows)} rows")
+                    break
+                except Exception as e:
+                    log.error(f"Sheets append failed ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}")
+                    if attempt < SHEET_RETRIES:
+                        time.sleep(RETRY_BACKOFF_SEC ** attempt)
+            rows, deadline = [], 0.0
 
 
-def log_to_sheet(tid: int):
+def _start_sheet_writer() -> Optional[threading.Thread]:
+    sheet = get_sheet()
     if sheet is None:
+        return None
+    t = threading.Thread(target=_sheet_worker, args=(sheet,), name="sheet-writer", daemon=True)
+    t.start()
+    return t
+
+
+def log_to_sheet(tid: int):
+    if get_sheet() is None:
         return
-    try:
-        sheet.append_row([datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"), tid])  # type: ignore
-    except Exception as e:
-        log.error(f"Sheets append failed: {e}")
+    _sheet_q.put([datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"), tid])
+
+# ───────────────────── Crossing bookkeeping ─────────────────────
+
+@njit(cache=True)
+def check_crossings(xs, prev_xs, last_count_times, line_x, now, cooldown):
+    """Boolean mask of tracks that crossed line_x left→right with their cooldown expired."""
+    return (prev_xs < line_x) & (line_x <= xs) & ((now - last_count_times) > cooldown)
+
+
+class TrackState:
+    """Per-track last x, last count time and last seen time in parallel arrays, indexed via an id→slot dict."""
+
+    def __init__(self, capacity: int = 64):
+        self.slot_of: Dict[int, int] = {}
+        self.free: List[int] = []            # slots released by prune(), reused first
+        self.last_x = np.zeros(capacity, np.int32)
+        self.last_count = np.zeros(capacity, np.float64)
+        self.last_seen = np.zeros(capacity, np.float64)
+
+    def slots(self, tids: List[int], xs: List[int], now: float) -> np.ndarray:
+        """Slots for tids, marked seen at now; a new ID starts at its current x so it can't count on first sight."""
+        out = np.empty(len(tids), np.int64)
+        for i, (tid, x) in enumerate(zip(tids, xs)):
+            s = self.slot_of.get(tid)
+            if s is None:
+                if self.free:
+                    s = self.free.pop()
+                else:
+                    s = len(self.slot_of)
+                    if s == len(self.last_x):    # full: double all arrays
+                        self.last_x = np.concatenate((self.last_x, np.zeros_like(self.last_x)))
+                        self.last_count = np.concatenate((self.last_count, np.zeros_like(self.last_count)))
+                        self.last_seen = np.concatenate((self.last_seen, np.zeros_like(self.last_seen)))
+                self.slot_of[tid] = s
+                self.last_x[s] = x
+                self.last_count[s] = 0.0
+            out[i] = s
+        self.last_seen[out] = now
+        return out
+
+    def prune(self, now: float, max_age: float):
+        """Release the slots of IDs unseen for more than max_age seconds."""
+        stale = [tid for tid, s in self.slot_of.items() if now - self.last_seen[s] > max_age]
+        for tid in stale:
+            self.free.append(self.slot_of.pop(tid))
+        if stale:
+            log.debug(f"Pruned {len(stale)} stale track IDs, {len(self.slot_of)} active")
 
 # ───────────────────── Main Processing Loop ─────────────────────
 
 def main():
+    model, device = get_model()
+    half = device == "cuda"               # FP16 only where it pays off
+    boat_id = boat_class_id(model)
+    mask, mask_roi = get_mask()
+    tracker = Sort(max_age=15, min_hits=3, iou_threshold=0.1)
+    sheet_thread = _start_sheet_writer()
     cam = Camera()
     boat_total = 0
-    id_last_x: Dict[int, int] = {}
-    id_last_count: Dict[int, float] = {}
+    state = TrackState()
+    frame_count = 0
     last_day_checked = datetime.now(TZ).date()
 
     try:
@@ -222,44 +441,48 @@ def main():
                 time.sleep(0.1)
                 continue
 
-            frame_proc = cv2.bitwise_and(frame, frame, mask=MASK) if MASK is not None else frame
+            frame_proc = apply_mask(frame, mask, mask_roi)
 
             # YOLO inference
-            detections: List[List[float]] = []
-            for r in model(frame_proc, conf=CONF_THRESHOLD, verbose=False):
-                for box, conf, cls in zip(r.boxes.xyxy.cpu(), r.boxes.conf.cpu(), r.boxes.cls.cpu()):
-                    # Filter only boats (COCO class 8 = boat) – adjust if you trained custom classes
-                    if int(cls) != 8:
-                        continue
-                    x1, y1, x2, y2 = box.tolist()
-                    detections.append([x1, y1, x2, y2, float(conf)])
+            detections = np.empty((0, 5), np.float32)
+            # Boats-only filtering happens inside YOLO's NMS, so every box returned is kept
+            for r in model(frame_proc, classes=[boat_id], conf=CONF_THRESHOLD, imgsz=IMGSZ,
+                           device=device, half=half, verbose=False):
+                xyxy = r.boxes.xyxy.cpu().numpy() + (mask_roi[0], mask_roi[1], mask_roi[0], mask_roi[1])
+                conf = r.boxes.conf.cpu().numpy()
+                detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)
 
             # Run tracker  ───────────────────────────────────────────
-            tracks = tracker.update(np.array(detections, dtype=np.float32))
+            tracks = tracker.update(detections)
 
             # Draw & count  ─────────────────────────────────────────
             line_x = int(frame.shape[1] * COUNT_LINE_RATIO)
             cv2.line(frame, (line_x, 0), (line_x, frame.shape[0]), (0, 255, 255), 2)
 
-            for x1, y1, x2, y2, tid in tracks:
-                x1, y1, x2, y2, tid = map(int, [x1, y1, x2, y2, tid])
+            # Int conversion and box centres for every track in one NumPy pass
+            tracks = np.asarray(tracks).reshape(-1, 5).astype(np.int32)
+            centers_x = (tracks[:, 0] + tracks[:, 2]) >> 1
+
+            # Count when crossing line (left→right), for all tracks at once
+            now_ts = time.time()
+            frame_count += 1
+            if frame_count % PRUNE_EVERY == 0:
+                state.prune(now_ts, STALE_ID_SEC)
+            slots = state.slots(tracks[:, 4].tolist(), centers_x.tolist(), now_ts)
+            prev_x = state.last_x[slots]
+            state.last_x[slots] = centers_x
+            counted = check_crossings(centers_x, prev_x, state.last_count[slots], line_x, now_ts, COOLDOWN_SEC)
+            state.last_count[slots[counted]] = now_ts
+
+            for (x1, y1, x2, y2, tid), crossed in zip(tracks.tolist(), counted.tolist()):
 
                 # Draw track box & ID
                 cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
                 cv2.putText(frame, f"ID {tid}", (x1, y1 - 5),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
 
-                # Count when crossing line (left→right)
-                center_x = (x1 + x2) // 2
-                last_x = id_last_x.get(tid, center_x)
-                id_last_x[tid] = center_x
-
-                crossed = last_x < line_x <= center_x
-                cooldown_ok = (time.time() - id_last_count.get(tid, 0)) > COOLDOWN_SEC
-
-                if crossed and cooldown_ok:
+                if crossed:
                     boat_total += 1
-                    id_last_count[tid] = time.time()
                     log.info(f"Boat #{boat_total}  (track ID {tid})")
                     save_snapshot(frame[y1:y2, x1:x2], tid)
                     log_to_sheet(tid)
@@ -276,6 +499,10 @@ def main():
         log.info("Ctrl-C received — exiting")
     finally:
         cam.release()
+        _snap_pool.shutdown(wait=True)
+        if sheet_thread is not None:
+            _sheet_q.put(None)
+            sheet_thread.join(timeout=30)
         if DISPLAY_WINDOW:
             cv2.destroyAllWindows()
         log.info("Shutdown complete")
@@ -15,8 +15,8 @@ Date: [Date]
 
 import cv2
 import numpy as np
-import math
 import time
+import os
 from ultralytics import YOLO
 from sort import *  # SORT (Simple Online and Realtime Tracking) for object tracking
 
@@ -25,8 +25,16 @@ from sort import *  # SORT (Simple Online and Realtime Tracking) for object trac
 
 VIDEO_SOURCE = 0  # 0 = USB webcam, "video.mp4" = local video file, "rtsp://..." = IP camera
 MODEL_PATH = "yolov8n.pt"  # YOLOv8 nano model - smallest and fastest for Raspberry Pi
+NCNN_MODEL_PATH = "yolov8n_ncnn_model"  # NCNN export of MODEL_PATH - ARM NEON backend, 2-3x faster than PyTorch on the Pi
+USE_INT8_TFLITE = True  # Prefer an INT8-quantized TFLite model (XNNPACK) over NCNN - ~1.4x faster again, less power
+INT8_TFLITE_PATH = "yolov8n_saved_model/yolov8n_full_integer_quant.tflite"  # INT8 TFLite export of MODEL_PATH
+INT8_CALIB_DATA = "coco128.yaml"  # Calibration images for INT8 export - point at boat footage for best accuracy
+IMGSZ = 320  # YOLO input size - ~4x fewer MACs than the default 640; delete old exports after changing it
 CLASS_FILTER = "boat"  # Only detect boats (can be changed to "person", "car", etc.)
 CONFIDENCE_THRESHOLD = 0.3  # Minimum confidence (0.0-1.0) - higher = fewer false positives
+MOTION_PIXEL_DIFF = 15  # Gray-level change (0-255) for a pixel of the 80x45 thumbnail to count as moving
+MOTION_MIN_PIXELS = 20  # Moving thumbnail pixels needed to run YOLO - still water skips inference; 0 = always run
+MASK_SOLID_COVERAGE = 0.95  # If the mask fills more than this share of its bounding box, just crop (skip bitwise_and)
 
 # === LINE CROSSING DETECTION SETTINGS ===
 # Virtual line coordinates: [x1, y1, x2, y2] - boats crossing this line will be counted
@@ -34,8 +42,8 @@ CONFIDENCE_THRESHOLD = 0.3  # Minimum confidence (0.0-1.0) - higher = fewer fals
 LIMITS = [100, 300, 500, 300]  # Horizontal line at y=300, from x=100 to x=500
 
 # Storage for unique boat IDs that have crossed the line
-# Using a list to prevent double-counting the same boat
-totalCount = []
+# Using a set to prevent double-counting the same boat (O(1) membership test)
+totalCount = set()
 
 # === HARDWARE INITIALIZATION ===
 # Initialize video capture - this connects to your camera or video source
@@ -47,10 +55,51 @@ cap = cv2.VideoCapture(VIDEO_SOURCE)
 cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
 cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
 
+# Keep only one frame queued in the driver so each read() returns the newest frame
+# (the default 4-frame V4L2 buffer would be up to 4 s stale at 1 FPS processing)
+if isinstance(VIDEO_SOURCE, int):
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
 # === AI MODEL INITIALIZATION ===
 # Load YOLO model for object detection
-print("[INFO] Loading YOLO model...")
-model = YOLO(MODEL_PATH)
+# Backend preference: INT8 TFLite, then NCNN, then the PyTorch weights
+# Each export is built once on first run and reused afterwards
+model = None
+if USE_INT8_TFLITE:
+    if not os.path.exists(INT8_TFLITE_PATH):
+        print(f"[INFO] Exporting {MODEL_PATH} to INT8 TFLite (one-time, calibrating on {INT8_CALIB_DATA})...")
+        try:
+            # export() returns the dynamic-range *_int8.tflite; the full-integer model is written alongside it
+            YOLO(MODEL_PATH).export(format="tflite", int8=True, data=INT8_CALIB_DATA, imgsz=IMGSZ)
+        except Exception as e:
+            print(f"[WARN] INT8 TFLite export unavailable: {e}")
+        if not os.path.exists(INT8_TFLITE_PATH):
+            print(f"[WARN] {INT8_TFLITE_PATH} not produced by the export - falling back to NCNN")
+    if os.path.exists(INT8_TFLITE_PATH):
+        # Ultralytics runs .tflite files through the TFLite interpreter (XNNPACK, multi-threaded)
+        # and handles input quantization and output dequantization itself
+        print(f"[INFO] Loading INT8 TFLite YOLO model from {INT8_TFLITE_PATH}...")
+        model = YOLO(INT8_TFLITE_PATH, task="detect")
+
+if model is None:
+    # The NCNN export needs the ncnn package
+    if not os.path.exists(NCNN_MODEL_PATH):
+        print(f"[INFO] Exporting {MODEL_PATH} to NCNN (one-time)...")
+        try:
+            NCNN_MODEL_PATH = YOLO(MODEL_PATH).export(format="ncnn", imgsz=IMGSZ)
+        except Exception as e:
+            print(f"[WARN] NCNN export unavailable, using PyTorch weights: {e}")
+    if os.path.exists(NCNN_MODEL_PATH):
+        print(f"[INFO] Loading NCNN YOLO model from {NCNN_MODEL_PATH}...")
+        model = YOLO(NCNN_MODEL_PATH, task="detect")
+    else:
+        print("[INFO] Loading YOLO model...")
+        model = YOLO(MODEL_PATH)
+
+# Look up the class index once so the detection loop compares ints, not class-name strings
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"[ERROR] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 
 # Initialize SORT tracker for maintaining object IDs across frames
 # max_age: How many frames to keep tracking an object after it disappears
@@ -63,95 +112,118 @@ tracker = Sort(max_age=20, min_hits=3, iou_threshold=0.3)
 # This is useful for ignoring irrelevant parts of the frame (e.g., sky, land)
 print("[INFO] Loading binary mask (if available)...")
 mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)
+roi_x0, roi_y0 = 0, 0  # Offset of the region YOLO sees; added back to its boxes
+mask_is_solid = False  # True when cropping alone is enough
 if mask is not None:
     # Ensure mask is binary (0 or 255) for proper masking
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
-    print("[INFO] Binary mask loaded successfully")
+    # Crop to the mask's bounding box once, so each frame only masks (and YOLO only sees)
+    # the region that can contain boats
+    ys, xs = np.nonzero(mask)
+    if ys.size:
+        roi_x0, roi_y0, roi_x1, roi_y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    else:
+        roi_x1, roi_y1 = mask.shape[1], mask.shape[0]
+    mask = mask[roi_y0:roi_y1, roi_x0:roi_x1]
+    # A (near-)rectangular mask blacks out almost nothing inside its box - save the per-frame pass
+    mask_is_solid = cv2.countNonZero(mask) > MASK_SOLID_COVERAGE * mask.size
+    print(f"[INFO] Binary mask loaded successfully - ROI ({roi_x0}, {roi_y0}, {roi_x1}, {roi_y1})"
+          + (", crop only" if mask_is_solid else ""))
 else:
     print("[INFO] No mask found - processing entire frame")
 
 # Performance tracking - used for frame rate limiting
 last_time = time.time()
 
+# Downscaled grayscale copy of the last processed frame, for the motion gate
+prev_small = None
+
 print("[INFO] Starting boat detection loop...")
 
 # === MAIN PROCESSING LOOP ===
 while True:
-    # Capture frame from video source
-    success, img = cap.read()
-    if not success:
+    # Pull the next frame from the video source without decoding it
+    # grab() keeps the capture buffer flushed; only the frame we process pays for decode
+    if not cap.grab():
         print("[ERROR] Failed to read frame - check video source")
         break
 
-    # === APPLY BINARY MASK (IF AVAILABLE) ===
-    # Masking helps focus detection on water areas and ignore irrelevant regions
-    # This improves both accuracy and performance
-    if mask is not None:
-        # Apply mask to focus on region of interest
-        imgMasked = cv2.bitwise_and(img, img, mask=mask)
-    else:
-        # Process entire frame if no mask is available
-        imgMasked = img
-
     # === FRAME RATE LIMITING FOR RASPBERRY PI ===
     # YOLO inference is computationally expensive
     # Limiting to 1 FPS conserves CPU resources and prevents overheating
     if time.time() - last_time >= 1:  # Process only once per second
-        
-        # Initialize empty array for detections
+
+        # Decode the grabbed frame
+        success, img = cap.retrieve()
+        if not success:
+            print("[ERROR] Failed to decode frame - check video source")
+            break
+
+        # === APPLY BINARY MASK (IF AVAILABLE) ===
+        # Masking helps focus detection on water areas and ignore irrelevant regions
+        # This improves both accuracy and performance
+        if mask is not None:
+            # Crop to the mask's bounding box, then black out what's outside the mask
+            roi = img[roi_y0:roi_y1, roi_x0:roi_x1]
+            imgMasked = roi if mask_is_solid else cv2.bitwise_and(roi, roi, mask=mask)
+        else:
+            # Process entire frame if no mask is available
+            imgMasked = img
+
+        # Detections for the tracker
         # Format: [x1, y1, x2, y2, confidence] for each detected object
-        detections = np.empty((0, 5))
+        detections = np.empty((0, 5), dtype=np.float32)
+
+        # === MOTION GATE ===
+        # An 80x45 gray diff against the last processed frame costs well under 1 ms;
+        # if (almost) nothing changed there is nothing new for YOLO to find
+        small = cv2.cvtColor(cv2.resize(imgMasked, (80, 45), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if prev_small is None or MOTION_MIN_PIXELS <= 0:
+            moving = True
+        else:
+            changed = cv2.threshold(cv2.absdiff(small, prev_small), MOTION_PIXEL_DIFF, 255, cv2.THRESH_BINARY)[1]
+            moving = cv2.countNonZero(changed) >= MOTION_MIN_PIXELS
+        prev_small = small
 
         # === YOLO OBJECT DETECTION ===
         # Run YOLO model on the masked image
+        # Only boats with sufficient confidence survive YOLO's own NMS, so every box returned is kept
         # stream=True enables memory-efficient processing
-        results = model(imgMasked, stream=True)
-        
-        # Process each detection result
-        for r in results:
-            boxes = r.boxes  # Get bounding boxes from YOLO output
-            
-            # Process each detected object
-            for box in boxes:
-                # Extract bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0]  # Top-left and bottom-right corners
-                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                w, h = x2 - x1, y2 - y1  # Calculate width and height
-
-                # Extract confidence score and class
-                conf = math.ceil((box.conf[0] * 100)) / 100  # Round to 2 decimal places
-                cls = int(box.cls[0])  # Class index
-                currentClass = model.names[cls]  # Convert index to class name
-
-                # Filter detections: only boats with sufficient confidence
-                if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:
-                    # Add detection to array for tracking
-                    currentArray = np.array([x1, y1, x2, y2, conf])
-                    detections = np.vstack((detections, currentArray))
+        # imgsz matches the static input shape the exports were built with
+        if moving:
+            results = model(imgMasked, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD,
+                            imgsz=IMGSZ, stream=True, verbose=False)
+
+            # Process each detection result
+            for r in results:
+                # Pull all boxes off the result at once instead of indexing tensors per box
+                # Shift from ROI coordinates back to full-frame coordinates for LIMITS
+                xyxy = r.boxes.xyxy.cpu().numpy() + (roi_x0, roi_y0, roi_x0, roi_y0)
+                conf = r.boxes.conf.cpu().numpy()
+                detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)
 
         # === OBJECT TRACKING WITH SORT ===
-        # Update tracker with new detections
+        # Update tracker with new detections (empty on still frames, so SORT still ages out old tracks)
         # Returns: [x1, y1, x2, y2, track_id] for each tracked object
         resultsTracker = tracker.update(detections)
 
         # === LINE CROSSING DETECTION ===
-        # Process each tracked object
-        for result in resultsTracker:
-            x1, y1, x2, y2, id = result  # Extract tracking result
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-            w, h = x2 - x1, y2 - y1
-            
-            # Calculate center point of the bounding box
-            cx, cy = x1 + w // 2, y1 + h // 2
-
-            # Check if boat center crosses the virtual counting line
-            # Line is defined by LIMITS: [x1, y1, x2, y2]
-            # Tolerance of ±15 pixels accounts for object size and tracking jitter
-            if LIMITS[0] < cx < LIMITS[2] and LIMITS[1] - 15 < cy < LIMITS[1] + 15:
-                # Only count if this boat ID hasn't been counted before
-                if id not in totalCount:
-                    totalCount.append(id)
-                    print(f"[{time.strftime('%H:%M:%S')}] Boat #{int(id)} counted.")
+        # Centers and the line test for every tracked object in one NumPy pass
+        tracks = resultsTracker.astype(np.int32)
+        cx = (tracks[:, 0] + tracks[:, 2]) // 2
+        cy = (tracks[:, 1] + tracks[:, 3]) // 2
+
+        # Check if boat center crosses the virtual counting line
+        # Line is defined by LIMITS: [x1, y1, x2, y2]
+        # Tolerance of ±15 pixels accounts for object size and tracking jitter
+        on_line = (LIMITS[0] < cx) & (cx < LIMITS[2]) & (np.abs(cy - LIMITS[1]) < 15)
+
+        # Only the (few) tracks on the line reach Python
+        for id in tracks[on_line, 4].tolist():
+            # Only count if this boat ID hasn't been counted before
+            if id not in totalCount:
+                totalCount.add(id)
+                print(f"[{time.strftime('%H:%M:%S')}] Boat #{id} counted.")
 
         # Display current count
         print(f"Total Boats: {len(totalCount)}")
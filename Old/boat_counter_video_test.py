@@ -2,7 +2,6 @@
 
 import cv2
 import numpy as np
-import math
 import time
 import os
 from datetime import datetime
@@ -12,6 +11,7 @@ from sort import *  # SORT Tracker
 # === CONFIGURATION ===
 VIDEO_SOURCE = "test_boats.mp4"  # Path to your boat video
 MODEL_PATH = "yolov8n.pt"
+IMGSZ = 320  # YOLO input size; 320 is plenty for boats and ~4x cheaper than 640
 CLASS_FILTER = "boat"
 CONFIDENCE_THRESHOLD = 0.3
 COUNT_LINE = [640 // 2, 150, 640 // 2, 350]  # Vertical line down the center of a 640px-wide frame
@@ -24,8 +24,11 @@ cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
 
 print("[DEBUG] Loading YOLO model...")
 model = YOLO(MODEL_PATH)
-tracker = Sort(max_age=20, min_hits=3, iou_threshold=0.3)
-totalCount = []
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"[DEBUG] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
+tracker = IOUTracker(max_age=20, min_hits=3, iou_threshold=0.3)  # every frame is processed, so IoU matching is enough
+totalCount = set()  # counted track IDs
 last_time = time.time()
 
 print("[DEBUG] Starting test...")
@@ -38,39 +41,36 @@ while True:
         break
 
     # Run YOLO once per frame for testing
-    detections = np.empty((0, 5))
-    results = model(img, stream=True)
+    # Class and confidence filtering happen inside YOLO's NMS
+    detections = np.empty((0, 5), dtype=np.float32)
+    results = model(img, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD,
+                    imgsz=IMGSZ, stream=True, verbose=False)
 
     for r in results:
-        for box in r.boxes:
-            x1, y1, x2, y2 = box.xyxy[0]
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-            w, h = x2 - x1, y2 - y1
-            conf = math.ceil((box.conf[0] * 100)) / 100
-            cls = int(box.cls[0])
-            currentClass = model.names[cls]
-
-            if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:
-                currentArray = np.array([x1, y1, x2, y2, conf])
-                detections = np.vstack((detections, currentArray))
+        # All boxes of the result in one transfer, not one tensor index per box
+        xyxy = r.boxes.xyxy.cpu().numpy()
+        conf = r.boxes.conf.cpu().numpy()
+        detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)
 
     resultsTracker = tracker.update(detections)
 
-    for result in resultsTracker:
-        x1, y1, x2, y2, id = result
-        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-        w, h = x2 - x1, y2 - y1
-        cx, cy = x1 + w // 2, y1 + h // 2
+    # Int boxes, centers and the crossing test for all tracks at once
+    tracks = resultsTracker.astype(np.int32)
+    centers_x = (tracks[:, 0] + tracks[:, 2]) // 2
+    centers_y = (tracks[:, 1] + tracks[:, 3]) // 2
+    on_line = ((COUNT_LINE[1] < centers_y) & (centers_y < COUNT_LINE[3])
+               & (np.abs(centers_x - COUNT_LINE[0]) < 15))
 
+    for (x1, y1, x2, y2, id), cx, cy, crossed in zip(tracks.tolist(), centers_x.tolist(),
+                                                      centers_y.tolist(), on_line.tolist()):
         # Check crossing line
-        if COUNT_LINE[1] < cy < COUNT_LINE[3] and COUNT_LINE[0] - 15 < cx < COUNT_LINE[0] + 15:
-            if id not in totalCount:
-                totalCount.append(id)
-                print(f"[DEBUG] Boat #{int(id)} counted at {datetime.now().strftime('%H:%M:%S')}")
+        if crossed and id not in totalCount:
+            totalCount.add(id)
+            print(f"[DEBUG] Boat #{id} counted at {datetime.now().strftime('%H:%M:%S')}")
 
         # === VISUAL DEBUG ===
         cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)
-        cv2.putText(img, f"ID: {int(id)}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
+        cv2.putText(img, f"ID: {id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
         cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)
 
     # Show count line and total
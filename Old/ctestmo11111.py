@@ -26,43 +26,76 @@ import cv2                                  # OpenCV for video processing and GU
 import numpy as np                          # For array and matrix operations
 import time                                 # For timing and delays
 import os                                   # For file and directory operations
+import sys                                  # Console encoding check for log()
+import json                                 # Sheets backlog file
+import threading                            # Background frame grabber
+from queue import Queue, Full, Empty        # Grabber hand-off and Sheets row queue
+from concurrent.futures import ThreadPoolExecutor  # Snapshot writes off the frame loop
 from datetime import datetime               # For timestamps
 from zoneinfo import ZoneInfo               # Native TZ support (Python 3.11+)
 from ultralytics import YOLO                # YOLOv8 object detection model
-from sort import *                          # SORT tracker for object tracking
+from sort import *                          # SORT / IoU trackers for object tracking
 import gspread                              # Google Sheets API
 from google.oauth2.service_account import Credentials  # Google service‑account auth
 import astral                               # Sunrise / sunset calculation
 import astral.sun as astral_sun             # For sunrise/sunset times
 
+try:
+    from numba import njit                  # JIT for the per-frame box / crossing maths; optional
+except ImportError:
+    def njit(*args, **kwargs):              # No numba: run the same code uncompiled
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
 # === CONSTANTS & CONFIG ===
 TIMEZONE       = ZoneInfo("America/Denver")         # Set timezone for all time operations
 VIDEO_SOURCE   = 0                                  # 0 == default PiCam. Replace with path if using a file.
 FRAME_WIDTH    = 640                                # Width of video frames
 FRAME_HEIGHT   = 360                                # Height of video frames
 COUNT_LINE_POS = 0.5                                # Normalised horizontal position of count line (0‑1)
+CLASS_FILTER   = "boat"                             # Only detect and count this COCO class
 DETECTION_CONF = 0.35                               # YOLO confidence threshold
+MASK_SOLID_COVERAGE = 0.95                          # Mask filling more of its bounding box than this is applied as a crop only
+IMGSZ          = 320                                # YOLO input size (~4× fewer MACs than 640); delete the NCNN export after changing
 COOLDOWN_SEC   = 5                                  # Seconds an ID must wait before it can be counted again
+DAY_CHECK_SEC  = 30                                 # Seconds between day/night checks (wall-clock time is only read then)
 SNAPSHOT_DIR   = "snapshots"                        # Folder to save snapshot images
+SNAPSHOT_QUALITY = 70                               # JPEG quality – snapshots are for the log, not forensics
 MODEL_PATH     = "yolov8n.pt"                       # Path to YOLOv8 model weights
+NCNN_PATH      = "yolov8n_ncnn_model"               # NCNN export of MODEL_PATH (ARM NEON backend), built on first run
 GSHEET_JSON    = "gsheets_creds.json"               # Google Sheets credentials file
 GSHEET_NAME    = "Boat Counter Logs"                # Google Sheet name
+SHEET_BATCH_ROWS = 20                               # Append queued Sheets rows once this many are waiting…
+SHEET_FLUSH_SEC  = 5                                # …or once the oldest has waited this long
+SHEET_RETRIES    = 3                                # Attempts per batch before its rows go to the backlog file
+SHEET_BACKLOG    = "sheet_backlog.jsonl"            # Unsent rows, saved on failure/exit and re-queued at startup
 
 # === HELPER – resilient console print ======================================
+_UTF8_OK = (sys.stdout.encoding or "").lower().startswith("utf")  # Checked once: can the console show emoji?
+
 def log(msg: str, emoji: str = "") -> None:
     """Print *msg* prefixed with an emoji when the terminal supports it."""
-    prefix = emoji  # Set emoji prefix
-    try:
-        prefix.encode("utf‑8").decode("utf‑8")  # Try encoding/decoding to check UTF-8 support
-    except UnicodeDecodeError:
-        prefix = ""  # Remove emoji if not supported
-    print(f"{prefix} {msg}" if prefix else msg)  # Print message with or without emoji
+    print(f"{emoji} {msg}" if (_UTF8_OK and emoji) else msg)  # Print message with or without emoji
 
 # === INITIAL SETUP =========================================================
 
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)  # Ensure the snapshot directory exists
+io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="boat-io")  # Runs snapshot writes in order, off the frame loop
 
-model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+if not os.path.exists(NCNN_PATH):  # Export once; needs the ncnn package
+    log(f"Exporting {MODEL_PATH} to NCNN (one-time)…", "⚙️")  # Log export
+    try:
+        NCNN_PATH = YOLO(MODEL_PATH).export(format="ncnn", imgsz=IMGSZ)  # Write the NCNN model folder
+    except Exception as e:
+        log(f"NCNN export unavailable – using PyTorch weights: {e}", "⚠️")  # Log export failure
+if os.path.exists(NCNN_PATH):
+    model = YOLO(NCNN_PATH, task="detect")  # NCNN backend: 2–3× faster than PyTorch on the Pi CPU
+else:
+    model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)  # Class index, looked up once
+if BOAT_CLASS_ID is None:  # Stop early rather than silently count nothing
+    raise SystemExit(f"Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 
 sheet = None  # Initialize Google Sheets variable
 try:
@@ -76,20 +109,97 @@ try:
 except Exception as e:
     log(f"Google Sheets not connected: {e}", "⚠️")  # Log failure
 
+sheet_q: Queue = Queue(maxsize=1000)  # Rows waiting for the writer thread; None flushes and stops it
+
+
+def save_backlog(rows: list) -> None:
+    """Append unsent Sheets rows to SHEET_BACKLOG (one JSON list per line) so they survive a restart."""
+    try:
+        with open(SHEET_BACKLOG, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        log(f"{len(rows)} Sheets rows saved to {SHEET_BACKLOG}", "💾")  # Log backlog write
+    except OSError as e:
+        log(f"Could not save {len(rows)} Sheets rows: {e}", "⚠️")  # Log lost rows
+
+
+def sheet_writer() -> None:
+    """Append queued rows in batches – one API call each – so Sheets latency never blocks the frame loop."""
+    rows: list = []  # Rows collected for the next append_rows call
+    deadline = None  # When the current batch must be sent
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)  # Wait briefly for the next row
+            if row is None:  # Shutdown: flush what we have and exit
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SEC
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            for attempt in range(1, SHEET_RETRIES + 1):
+                try:
+                    sheet.append_rows(rows, value_input_option="RAW")  # Whole batch in one round-trip
+                    rows = []
+                    break
+                except Exception as e:
+                    log(f"Sheets append error ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}", "⚠️")  # Log Sheets error
+                    if attempt < SHEET_RETRIES:
+                        time.sleep(2 ** attempt)  # Back off before retrying
+            if rows:  # Still unsent after all retries: keep them for the next run
+                save_backlog(rows)
+            rows, deadline = [], None
+
+
+def queue_sheet_row(row: list) -> None:
+    try:
+        sheet_q.put_nowait(row)  # Hand the row to the writer thread
+    except Full:  # Writer badly behind (offline for a long time): park the row on disk instead
+        save_backlog([row])
+
+
+sheet_thread: threading.Thread | None = None  # Background writer, only started when Sheets is connected
+if sheet is not None:
+    if os.path.exists(SHEET_BACKLOG):  # Re-queue rows a previous run couldn't send
+        with open(SHEET_BACKLOG, encoding="utf-8") as f:
+            backlog = [json.loads(line) for line in f if line.strip()]
+        os.remove(SHEET_BACKLOG)
+        log(f"Re-queuing {len(backlog)} Sheets rows from {SHEET_BACKLOG}", "💾")  # Log backlog replay
+        for row in backlog:
+            queue_sheet_row(row)
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
 mask = None  # Initialize mask variable
+mask_is_solid = False  # True when the mask fills (almost) its whole bounding box – cropping is enough
+roi_x0, roi_y0 = 0, 0  # Top-left of the mask's bounding box; added back to YOLO's boxes
 if os.path.exists("mask.png"):  # If mask file exists
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)  # Load mask as grayscale
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]  # Ensure mask is binary
-    log("Mask loaded", "🖼️")  # Log mask loaded
+    ys, xs = np.nonzero(mask)  # Find the mask's bounding box once
+    if ys.size:
+        roi_x0, roi_y0, roi_x1, roi_y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    else:
+        roi_x1, roi_y1 = mask.shape[1], mask.shape[0]
+    mask = mask[roi_y0:roi_y1, roi_x0:roi_x1]  # Keep only the part inside the bounding box
+    mask_is_solid = cv2.countNonZero(mask) > MASK_SOLID_COVERAGE * mask.size  # Skip bitwise_and if it would black out ~nothing
+    log(f"Mask loaded – YOLO sees ROI ({roi_x0}, {roi_y0}, {roi_x1}, {roi_y1})", "🖼️")  # Log mask loaded
 else:
     log("No mask found – using full frame.", "ℹ️")  # Log no mask found
 
 city = astral.LocationInfo(latitude=38.833, longitude=-104.821, timezone="America/Denver")  # Set city/location for Astral
+sun_day = None  # Date the cached dawn/dusk belong to
+dawn_cached = dusk_cached = None  # Cached dawn/dusk for sun_day
 
 def is_daytime(ts: datetime | None = None) -> bool:
+    global sun_day, dawn_cached, dusk_cached
     ts = ts or datetime.now(TIMEZONE)  # Use current time if not provided
-    s = astral_sun.sun(city.observer, date=ts.date(), tzinfo=TIMEZONE)  # Get sunrise/sunset times
-    return s["dawn"] <= ts <= s["dusk"]  # Return True if current time is between dawn and dusk
+    if ts.date() != sun_day:  # Only run the Astral calculation once per day
+        s = astral_sun.sun(city.observer, date=ts.date(), tzinfo=TIMEZONE)  # Get sunrise/sunset times
+        sun_day, dawn_cached, dusk_cached = ts.date(), s["dawn"], s["dusk"]  # Cache them for the rest of the day
+    return dawn_cached <= ts <= dusk_cached  # Return True if current time is between dawn and dusk
 
 # Camera setup and robust reopen routine
 
@@ -97,6 +207,8 @@ def open_camera() -> cv2.VideoCapture | None:
     cap = cv2.VideoCapture(VIDEO_SOURCE)  # Open video source (camera or file)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)  # Set frame width
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)  # Set frame height
+    if isinstance(VIDEO_SOURCE, int):  # Live camera: newest frame only, no stale backlog
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Shrink the driver's frame queue to one
     for _ in range(10):  # Try up to 10 times to get a valid frame
         ok, _ = cap.read()
         if ok:
@@ -106,70 +218,163 @@ def open_camera() -> cv2.VideoCapture | None:
     cap.release()  # Release camera resource
     return None  # Return None if camera not available
 
-cap = open_camera()  # Open the camera at startup
-
-mot_tracker = Sort(max_age=15, min_hits=3, iou_threshold=0.1)  # Initialize SORT tracker
-id_last_x   = {}            # Dictionary to store last x position for each track ID
-last_count  = {}            # Dictionary to store last count timestamp for each track ID
+class FrameGrabber(threading.Thread):
+    """Read frames on a background thread so USB/V4L2 decode overlaps YOLO inference."""
+
+    def __init__(self, cap: cv2.VideoCapture):
+        super().__init__(name="frame-grabber", daemon=True)
+        self.cap = cap                                      # Capture object owned by this grabber
+        self.q: Queue = Queue(maxsize=1)                    # Holds the next (ok, frame) for the main loop
+        self.live = isinstance(VIDEO_SOURCE, int)           # Camera: serve the newest frame; file: keep every frame
+        self.running = threading.Event()                    # Cleared to stop the thread
+        self.running.set()
+
+    def run(self) -> None:
+        while self.running.is_set():
+            item = self.cap.read()  # (ok, frame) – read() allocates a fresh array, so no copy is needed
+            while self.running.is_set():
+                try:
+                    self.q.put(item, timeout=0.1)  # Hand the frame to the main loop
+                    break
+                except Full:
+                    if self.live:  # Drop the stale frame so the newest is always served
+                        try:
+                            self.q.get_nowait()
+                        except Empty:
+                            pass
+            if not item[0]:  # Camera failure / end of file: let the main loop see it and reopen
+                return
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        try:
+            return self.q.get(timeout=2.0)  # Wait for the next frame
+        except Empty:
+            return False, None  # Grabber stalled – treat as a failed read
+
+    def stop(self) -> None:
+        self.running.clear()  # Ask the thread to exit
+        self.join(timeout=1)  # Let it finish its current read
+        self.cap.release()  # Release camera
+
+
+grabber: FrameGrabber | None = None  # Background grabber (owns the camera); started by the main loop
+
+mot_tracker = IOUTracker(max_age=15, min_hits=3, iou_threshold=0.1)  # Greedy IoU tracker – no per-track Kalman filter at full frame rate
 boat_total  = 0             # Total number of boats counted
 
+
+class TrackState:
+    """Side of the count line and last count time per track, in parallel NumPy arrays indexed via a track ID → slot dict."""
+
+    def __init__(self, capacity: int = 1024):
+        self.slot_of: dict[int, int] = {}                  # Track ID → array slot
+        self.side = np.zeros(capacity, np.int8)            # Side of the count line per slot (-1 left, 0 on, 1 right)
+        self.last_count = np.full(capacity, -np.inf)       # Last count time per slot (time.monotonic seconds)
+
+    def slots(self, tids: list[int], sides: list[int]) -> np.ndarray:
+        """Slots for *tids*; a new ID starts on its current side so it can't count on first sight."""
+        out = np.empty(len(tids), np.int64)
+        for i, (tid, side) in enumerate(zip(tids, sides)):
+            s = self.slot_of.get(tid)
+            if s is None:
+                s = len(self.slot_of)  # Next free slot
+                if s == len(self.side):  # Full: double both arrays
+                    self.side = np.concatenate((self.side, np.zeros_like(self.side)))
+                    self.last_count = np.concatenate((self.last_count, np.full_like(self.last_count, -np.inf)))
+                self.slot_of[tid] = s
+                self.side[s] = side
+            out[i] = s
+        return out
+
+
+state = TrackState()  # Per-track crossing state
+
 def count_line_x(width: int) -> int:
     return int(width * COUNT_LINE_POS)  # Calculate x position of counting line
 
+
+@njit(cache=True)
+def boxes_to_detections(xyxy, conf, cls, boat_id, dx, dy):
+    """[x1, y1, x2, y2, conf] rows for the boxes of class *boat_id*, shifted by (dx, dy) to full-frame coordinates."""
+    out = np.empty((cls.shape[0], 5))  # Worst case: every box is a boat
+    n = 0  # Boat boxes written so far
+    for i in range(cls.shape[0]):
+        if int(cls[i]) == boat_id:  # Boats only
+            out[n, 0] = int(xyxy[i, 0]) + dx  # Truncate to pixels, ROI → full frame
+            out[n, 1] = int(xyxy[i, 1]) + dy
+            out[n, 2] = int(xyxy[i, 2]) + dx
+            out[n, 3] = int(xyxy[i, 3]) + dy
+            out[n, 4] = conf[i]  # Detection confidence
+            n += 1
+    return out[:n]
+
+
+@njit(cache=True)
+def check_crossings(sides, prev_sides, last_counts, now, cooldown):
+    """Boolean mask of tracks that went from left of the line to on/right of it with their cooldown expired."""
+    return (prev_sides < 0) & (sides >= 0) & (now - last_counts >= cooldown)
+
 # === MAIN LOOP =============================================================
 
 log("Starting boat detection. Press 'Q' to exit.", "🎥")  # Log start of detection
 last_daily_check = datetime.now(TIMEZONE).date()  # Track last date checked for sunrise/sunset
+next_day_check = 0.0  # Monotonic time of the next day/night check
 
 while True:
-    now = datetime.now(TIMEZONE)  # Get current time
-
-    # Sunrise/sunset check once per day
-    if now.date() != last_daily_check:
-        log(f"Checking sunrise/sunset for {now.date()}", "📆")  # Log daily check
-        last_daily_check = now.date()  # Update last checked date
-
-    # Sleep at night
-    if not is_daytime(now):
-        log(f"Night – sleeping 5 min ({now:%H:%M:%S})", "🌙")  # Log sleep
-        if cap:
-            cap.release()  # Release camera
-            cap = None
-        cv2.destroyAllWindows()  # Close OpenCV windows
-        time.sleep(300)  # Sleep for 5 minutes
-        continue  # Skip to next loop
+    now_mono = time.monotonic()  # Cheap clock for cooldowns and check scheduling
+
+    if now_mono >= next_day_check:
+        next_day_check = now_mono + DAY_CHECK_SEC  # Next check in DAY_CHECK_SEC
+        now = datetime.now(TIMEZONE)  # Wall-clock time, only needed for the day/night decision
+
+        # Sunrise/sunset check once per day
+        if now.date() != last_daily_check:
+            log(f"Checking sunrise/sunset for {now.date()}", "📆")  # Log daily check
+            last_daily_check = now.date()  # Update last checked date
+
+        # Sleep at night
+        if not is_daytime(now):
+            log(f"Night – sleeping 5 min ({now:%H:%M:%S})", "🌙")  # Log sleep
+            if grabber:
+                grabber.stop()  # Stop grabbing and release camera
+                grabber = None
+            cv2.destroyAllWindows()  # Close OpenCV windows
+            time.sleep(300)  # Sleep for 5 minutes
+            continue  # Skip to next loop
 
     # Ensure camera available
-    if cap is None or not cap.isOpened():
+    if grabber is None:
         log("(Re)initialising camera…", "🌞")  # Log camera reinitialization
         cap = open_camera()  # Try to open camera
         if cap is None:
             time.sleep(5)  # Wait before retrying
             continue
+        grabber = FrameGrabber(cap)  # Read frames in the background from now on
+        grabber.start()
 
-    # Grab frame (retry up to 3 times)
-    ok, frame = cap.read()  # Read a frame from the camera
+    # Take the newest frame from the grabber
+    ok, frame = grabber.read()  # Wait for the next frame
     if not ok or frame is None:
         log("Frame grab failed – retrying next loop", "⚠️")  # Log frame grab failure
-        cap.release()  # Release camera
-        cap = None
+        grabber.stop()  # Stop grabbing and release camera
+        grabber = None
         continue
 
     # Apply mask
     if mask is not None:
-        frame_proc = cv2.bitwise_and(frame, frame, mask=mask)  # Apply mask to frame
+        roi = frame[roi_y0:roi_y1, roi_x0:roi_x1]  # Crop to the mask's bounding box (a view, no copy)
+        frame_proc = roi if mask_is_solid else cv2.bitwise_and(roi, roi, mask=mask)  # Apply mask to the cropped region
     else:
         frame_proc = frame  # Use full frame if no mask
 
     # YOLO detection
-    results = model(frame_proc, verbose=False, conf=DETECTION_CONF)  # Run YOLO detection
-    detections = []  # List to store detections
-    for r in results:
-        for *box, conf, cls in r.boxes:
-            if int(cls) == 0:  # class 0 assumed boat
-                x1, y1, x2, y2 = map(int, box)  # Get bounding box coordinates
-                detections.append([x1, y1, x2, y2, float(conf)])  # Add detection
-    det_np = np.array(detections) if detections else np.empty((0, 5))  # Convert to numpy array
+    results = model(frame_proc, verbose=False, conf=DETECTION_CONF, imgsz=IMGSZ)  # Run YOLO detection
+    detections = [  # Boat boxes of every result, one compiled pass each
+        boxes_to_detections(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy(),
+                            BOAT_CLASS_ID, roi_x0, roi_y0)
+        for r in results
+    ]
+    det_np = np.vstack(detections) if detections else np.empty((0, 5))  # Stack into one (N, 5) array
     tracks = mot_tracker.update(det_np)  # Update tracker with detections
 
     # Draw count line
@@ -178,35 +383,32 @@ while True:
     cv2.line(frame, (cx, 0), (cx, fh), (0, 0, 255), 2)  # Draw vertical count line
 
     # Process tracks
-    for *xyxy, tid in tracks:
-        x1, y1, x2, y2 = map(int, xyxy)  # Get bounding box coordinates
-        x_center = (x1 + x2) // 2  # Calculate center x
-        y_center = (y1 + y2) // 2  # Calculate center y
-
+    tracks = tracks.astype(np.int32)  # Int boxes and IDs for all tracks at once
+    centers_x = (tracks[:, 0] + tracks[:, 2]) // 2  # Center x of every track in one NumPy pass
+    sides = np.sign(centers_x - cx).astype(np.int8)  # Side of the count line for every track
+    slots = state.slots(tracks[:, 4].tolist(), sides.tolist())  # Array slot of every track
+    prev_side = state.side[slots]  # Sides in the previous frame
+    state.side[slots] = sides  # Update sides
+    # Left → on/right transition with the cooldown expired – all tracks at once
+    counted = check_crossings(sides, prev_side, state.last_count[slots], now_mono, COOLDOWN_SEC)
+    state.last_count[slots[counted]] = now_mono  # Update last count times
+
+    for x1, y1, x2, y2, tid in tracks.tolist():
         # Draw bounding box and ID
         cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)  # Draw bounding box
-        cv2.putText(frame, str(int(tid)), (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)  # Draw track ID
-
-        prev_x = id_last_x.get(tid, x_center)  # Get previous x position
-        id_last_x[tid] = x_center  # Update last x position
-
-        # Check crossing from left to right
-        crossed = prev_x < cx <= x_center  # Check if object crossed the line
-        if crossed:
-            last_ts = last_count.get(tid, 0)  # Get last count timestamp
-            if now.timestamp() - last_ts >= COOLDOWN_SEC:  # Check cooldown
-                boat_total += 1  # Increment boat count
-                last_count[tid] = now.timestamp()  # Update last count timestamp
-                log(f"Boat #{boat_total} detected (track {int(tid)})", "🚤")  # Log detection
-                # Snapshot
-                snap_path = os.path.join(SNAPSHOT_DIR, f"boat_{boat_total}_{int(tid)}.jpg")  # Path for snapshot
-                cv2.imwrite(snap_path, frame)  # Save snapshot
-                # Google Sheets append
-                if sheet is not None:
-                    try:
-                        sheet.append_row([now.isoformat(), boat_total, int(tid), snap_path])  # Log to Google Sheets
-                    except Exception as e:
-                        log(f"Sheets append error: {e}", "⚠️")  # Log Sheets error
+        cv2.putText(frame, str(tid), (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)  # Draw track ID
+
+    for tid in tracks[counted, 4].tolist():  # Only the tracks that just crossed
+        boat_total += 1  # Increment boat count
+        now = datetime.now(TIMEZONE)  # Wall-clock time for the Sheets row
+        log(f"Boat #{boat_total} detected (track {tid})", "🚤")  # Log detection
+        # Snapshot
+        snap_path = os.path.join(SNAPSHOT_DIR, f"boat_{boat_total}_{tid}.jpg")  # Path for snapshot
+        # Copy: the frame keeps being drawn on while the encoder runs
+        io_pool.submit(cv2.imwrite, snap_path, frame.copy(), [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY])  # Save snapshot
+        # Google Sheets append
+        if sheet is not None:
+            queue_sheet_row([now.isoformat(), boat_total, tid, snap_path])  # Queue the row for the writer thread
 
     # Display
     cv2.imshow("Boat Counter", frame)  # Show frame in window
@@ -215,6 +417,20 @@ while True:
 
 # === CLEANUP ===============================================================
 log("Exiting – cleaning up", "🛑")  # Log cleanup
-if cap:
-    cap.release()  # Release camera
+if grabber:
+    grabber.stop()  # Stop the grabber and release camera
+io_pool.shutdown(wait=True)  # Finish pending snapshots
+if sheet_thread:
+    sheet_q.put(None)  # Ask the writer to flush remaining rows
+    sheet_thread.join(timeout=30)  # Give the final append (and its retries) a chance to finish
+    leftover = []  # Rows the writer never picked up
+    while True:
+        try:
+            row = sheet_q.get_nowait()
+        except Empty:
+            break
+        if row is not None:
+            leftover.append(row)
+    if leftover:
+        save_backlog(leftover)  # Keep them for the next run
 cv2.destroyAllWindows()  # Close OpenCV windows
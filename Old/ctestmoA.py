@@ -26,6 +26,11 @@ import cv2                                  # OpenCV for video processing and GU
 import numpy as np                          # For array and matrix operations
 import time                                 # For timing and delays
 import os                                   # For file and directory operations
+import sys                                  # Console encoding check for log()
+import json                                 # Sheets backlog file
+import threading                            # Background frame grabber
+from queue import Queue, Full, Empty        # Grabber hand-off and Sheets row queue
+from concurrent.futures import ThreadPoolExecutor  # Snapshot writes off the frame loop
 from datetime import datetime               # For timestamps
 from zoneinfo import ZoneInfo               # Native TZ support (Python 3.11+)
 from ultralytics import YOLO                # YOLOv8 object detection model
@@ -34,6 +39,14 @@ import gspread                              # Google Sheets API
 from google.oauth2.service_account import Credentials  # Google service‑account auth
 import astral                               # Sunrise / sunset calculation
 import astral.sun as astral_sun
+
+try:
+    from numba import njit                  # JIT for the per-frame box / crossing maths; optional
+except ImportError:
+    def njit(*args, **kwargs):              # no numba: run the same code uncompiled
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
 from picamera2 import Picamera2             # Pi Camera 2 for frame capture
 
 # === CONSTANTS & CONFIG ===
@@ -42,31 +55,50 @@ VIDEO_SOURCE   = 0                # 0 == default PiCam.  Replace with path if us
 FRAME_WIDTH    = 640
 FRAME_HEIGHT   = 360
 COUNT_LINE_POS = 0.5              # Normalised horizontal position of count line (0‑1)
+CLASS_FILTER   = "boat"           # Only detect and count this COCO class
 DETECTION_CONF = 0.35             # YOLO confidence threshold
+MASK_SOLID_COVERAGE = 0.95        # mask covering more of its bounding box than this is applied as a crop only
+IMGSZ          = 320              # YOLO input size (~4× fewer MACs than 640); delete the NCNN export after changing
 COOLDOWN_SEC   = 5                # Seconds an ID must wait before it can be counted again
+DAY_CHECK_SEC  = 30               # Seconds between day/night checks (wall-clock time is only read then)
 SNAPSHOT_DIR   = "snapshots"      # Folder to save snapshot images
+SNAPSHOT_QUALITY = 70             # JPEG quality – snapshots are for the log, not forensics
 MODEL_PATH     = "yolov8n.pt"     # Tiny default model (change to your custom model if needed)
+NCNN_PATH      = "yolov8n_ncnn_model"  # NCNN export of MODEL_PATH (ARM NEON backend), built on first run
 GSHEET_JSON    = "gsheets_creds.json"
 GSHEET_NAME    = "Boat Counter Logs"
+SHEET_BATCH_ROWS = 20             # append queued rows once this many are waiting…
+SHEET_FLUSH_SEC  = 5              # …or once the oldest has waited this long
+SHEET_RETRIES    = 3              # attempts per batch before its rows go to the backlog file
+SHEET_BACKLOG    = "sheet_backlog.jsonl"  # unsent rows, saved on failure/exit and re-queued at startup
 
 # === HELPER – resilient console print ======================================
 
+_UTF8_OK = (sys.stdout.encoding or "").lower().startswith("utf")   # decided once at import
+
 def log(msg: str, emoji: str = "") -> None:
     """Print *msg* prefixed with an emoji when the terminal supports it."""
-    prefix = emoji
-    try:
-        prefix.encode("utf‑8").decode("utf‑8")
-    except UnicodeDecodeError:
-        prefix = ""
-    print(f"{prefix} {msg}" if prefix else msg)
+    print(f"{emoji} {msg}" if (_UTF8_OK and emoji) else msg)
 
 
 # === INITIAL SETUP =========================================================
 
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)
 
-# Load model once (consider using GPU if available)
-model = YOLO(MODEL_PATH)
+# One worker: snapshots are written in order, off the frame loop
+io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="boat-io")
+
+# Load model once; prefer the NCNN export (2–3× faster than PyTorch on the Pi CPU)
+if not os.path.exists(NCNN_PATH):
+    log(f"Exporting {MODEL_PATH} to NCNN (one-time)…", "⚙️")
+    try:
+        NCNN_PATH = YOLO(MODEL_PATH).export(format="ncnn", imgsz=IMGSZ)
+    except Exception as e:
+        log(f"NCNN export unavailable – using PyTorch weights: {e}", "⚠️")
+model = YOLO(NCNN_PATH, task="detect") if os.path.exists(NCNN_PATH) else YOLO(MODEL_PATH)
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 
 # Google Sheets
 sheet = None
@@ -81,82 +113,257 @@ try:
 except Exception as e:
     log(f"Google Sheets not connected: {e}", "⚠️")
 
+
+sheet_q: Queue = Queue(maxsize=1000)   # rows for the writer thread; None flushes and stops it
+
+
+def save_backlog(rows: list) -> None:
+    """Append unsent rows to SHEET_BACKLOG (one JSON list per line) for the next run."""
+    try:
+        with open(SHEET_BACKLOG, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        log(f"{len(rows)} Sheets rows saved to {SHEET_BACKLOG}", "💾")
+    except OSError as e:
+        log(f"Could not save {len(rows)} Sheets rows: {e}", "⚠️")
+
+
+def sheet_writer() -> None:
+    """Append queued rows in batches, one API call each, retrying with backoff."""
+    rows: list = []
+    deadline = None
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)
+            if row is None:
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SEC
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            for attempt in range(1, SHEET_RETRIES + 1):
+                try:
+                    sheet.append_rows(rows, value_input_option="RAW")
+                    rows = []
+                    break
+                except Exception as e:
+                    log(f"Sheets append error ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}", "⚠️")
+                    if attempt < SHEET_RETRIES:
+                        time.sleep(2 ** attempt)
+            if rows:                       # unsent after all retries
+                save_backlog(rows)
+            rows, deadline = [], None
+
+
+def queue_sheet_row(row: list) -> None:
+    try:
+        sheet_q.put_nowait(row)
+    except Full:                           # writer far behind: park the row on disk
+        save_backlog([row])
+
+
+sheet_thread: threading.Thread | None = None
+if sheet is not None:
+    if os.path.exists(SHEET_BACKLOG):      # rows a previous run couldn't send
+        with open(SHEET_BACKLOG, encoding="utf-8") as f:
+            backlog = [json.loads(line) for line in f if line.strip()]
+        os.remove(SHEET_BACKLOG)
+        log(f"Re-queuing {len(backlog)} Sheets rows from {SHEET_BACKLOG}", "💾")
+        for row in backlog:
+            queue_sheet_row(row)
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
 # Optional mask
 mask = None
+roi_x0, roi_y0 = 0, 0             # top-left of the mask's bounding box; added back to YOLO's boxes
+mask_is_solid = False             # mask fills ~all of its bounding box: crop, skip bitwise_and
 if os.path.exists("mask.png"):
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
-    log("Mask loaded", "🖼️")
+    # Crop to the bounding box once; YOLO only ever sees this region
+    ys, xs = np.nonzero(mask)
+    if ys.size:
+        roi_x0, roi_y0, roi_x1, roi_y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    else:
+        roi_x1, roi_y1 = mask.shape[1], mask.shape[0]
+    mask = mask[roi_y0:roi_y1, roi_x0:roi_x1]
+    mask_is_solid = cv2.countNonZero(mask) > MASK_SOLID_COVERAGE * mask.size
+    log(f"Mask loaded – YOLO sees ROI ({roi_x0}, {roi_y0}, {roi_x1}, {roi_y1})", "🖼️")
 else:
     log("No mask found – using full frame.", "ℹ️")
 
 # Astral – sunrise / sunset helper
 city = astral.LocationInfo(latitude=38.833, longitude=-104.821, timezone="America/Denver")
+sun_day = None                   # date the cached dawn/dusk belong to
+dawn_cached = dusk_cached = None
 
 def is_daytime(ts: datetime | None = None) -> bool:
+    global sun_day, dawn_cached, dusk_cached
     ts = ts or datetime.now(TIMEZONE)
-    s = astral_sun.sun(city.observer, date=ts.date(), tzinfo=TIMEZONE)
-    return s["dawn"] <= ts <= s["dusk"]
+    if ts.date() != sun_day:     # Astral only once per day
+        s = astral_sun.sun(city.observer, date=ts.date(), tzinfo=TIMEZONE)
+        sun_day, dawn_cached, dusk_cached = ts.date(), s["dawn"], s["dusk"]
+    return dawn_cached <= ts <= dusk_cached
 
 # Camera setup and robust reopen routine
 
 picam2 = Picamera2()
+# Have the ISP deliver frames at the processing size, already in OpenCV's 3-channel
+# BGR layout ("RGB888" in libcamera terms); the default preview config is 640x480 XBGR
+picam2.configure(picam2.create_video_configuration(
+    main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"}))
 picam2.start()
 
+
+class FrameGrabber(threading.Thread):
+    """Capture on a background thread so the camera keeps up while YOLO runs."""
+
+    def __init__(self, cam: Picamera2):
+        super().__init__(name="frame-grabber", daemon=True)
+        self.cam = cam
+        self.q: Queue = Queue(maxsize=1)   # newest frame only
+        self.running = threading.Event()
+        self.running.set()
+
+    def run(self) -> None:
+        while self.running.is_set():
+            frame = self.cam.capture_array()
+            try:
+                self.q.put_nowait(frame)
+            except Full:                   # drop the stale frame, serve the newest
+                try:
+                    self.q.get_nowait()
+                except Empty:
+                    pass
+                self.q.put_nowait(frame)
+
+    def read(self) -> np.ndarray | None:
+        try:
+            return self.q.get(timeout=2.0)
+        except Empty:
+            return None                    # camera stalled
+
+    def stop(self) -> None:
+        self.running.clear()
+        self.join(timeout=1)
+
+
+grabber = FrameGrabber(picam2)
+grabber.start()
+
 # Tracking state
-mot_tracker = Sort(max_age=15, min_hits=3, iou_threshold=0.1)
-id_last_x   = {}            # track_id -> previous x_center
-last_count  = {}            # track_id -> last count timestamp
+mot_tracker = IOUTracker(max_age=15, min_hits=3, iou_threshold=0.1)  # full frame rate: plain IoU matching is enough
 boat_total  = 0
 
+
+class TrackState:
+    """Side of the count line and last count time per track, in parallel NumPy arrays indexed via a track ID → slot dict."""
+
+    def __init__(self, capacity: int = 1024):
+        self.slot_of: dict[int, int] = {}
+        self.side = np.zeros(capacity, np.int8)         # -1 left of the line, 0 on it, 1 right
+        self.last_count = np.full(capacity, -np.inf)   # time.monotonic() seconds
+
+    def slots(self, tids: list[int], sides: list[int]) -> np.ndarray:
+        """Slots for *tids*; a new ID starts on its current side so it can't count on first sight."""
+        out = np.empty(len(tids), np.int64)
+        for i, (tid, side) in enumerate(zip(tids, sides)):
+            s = self.slot_of.get(tid)
+            if s is None:
+                s = len(self.slot_of)
+                if s == len(self.side):  # full: double both arrays
+                    self.side = np.concatenate((self.side, np.zeros_like(self.side)))
+                    self.last_count = np.concatenate((self.last_count, np.full_like(self.last_count, -np.inf)))
+                self.slot_of[tid] = s
+                self.side[s] = side
+            out[i] = s
+        return out
+
+
+state = TrackState()
+
 # Counting line function
 
 def count_line_x(width: int) -> int:
     return int(width * COUNT_LINE_POS)
 
+
+@njit(cache=True)
+def boxes_to_detections(xyxy, conf, cls, boat_id, dx, dy):
+    """[x1, y1, x2, y2, conf] rows for the *boat_id* boxes, shifted by (dx, dy) from ROI to full frame."""
+    out = np.empty((cls.shape[0], 5))
+    n = 0
+    for i in range(cls.shape[0]):
+        if int(cls[i]) == boat_id:
+            out[n, 0] = int(xyxy[i, 0]) + dx
+            out[n, 1] = int(xyxy[i, 1]) + dy
+            out[n, 2] = int(xyxy[i, 2]) + dx
+            out[n, 3] = int(xyxy[i, 3]) + dy
+            out[n, 4] = conf[i]
+            n += 1
+    return out[:n]
+
+
+@njit(cache=True)
+def check_crossings(sides, prev_sides, last_counts, now, cooldown):
+    """Boolean mask of tracks that moved from left of the line to on/right of it, cooldown expired."""
+    return (prev_sides < 0) & (sides >= 0) & (now - last_counts >= cooldown)
+
 # === MAIN LOOP =============================================================
 
 log("Starting boat detection. Press 'Q' to exit.", "🎥")
 last_daily_check = datetime.now(TIMEZONE).date()
+next_day_check = 0.0              # monotonic time of the next day/night check
 
 while True:
-    now = datetime.now(TIMEZONE)
-
-    # Sunrise/sunset check once per day
-    if now.date() != last_daily_check:
-        log(f"Checking sunrise/sunset for {now.date()}", "📆")
-        last_daily_check = now.date()
-
-    # Sleep at night
-    if not is_daytime(now):
-        log(f"Night – sleeping 5\u202fmin ({{now:%H:%M:%S}})", "🌙")
-        picam2.stop()
-        cv2.destroyAllWindows()
-        time.sleep(300)
-        picam2.start()
-        continue
-
-    # Grab frame (no retry needed)
-    frame = picam2.capture_array()
+    now_mono = time.monotonic()   # cooldowns and check scheduling; no tz lookup per frame
+
+    if now_mono >= next_day_check:
+        next_day_check = now_mono + DAY_CHECK_SEC
+        now = datetime.now(TIMEZONE)
+
+        # Sunrise/sunset check once per day
+        if now.date() != last_daily_check:
+            log(f"Checking sunrise/sunset for {now.date()}", "📆")
+            last_daily_check = now.date()
+
+        # Sleep at night
+        if not is_daytime(now):
+            log(f"Night – sleeping 5\u202fmin ({now:%H:%M:%S})", "🌙")
+            grabber.stop()
+            picam2.stop()
+            cv2.destroyAllWindows()
+            time.sleep(300)
+            picam2.start()
+            grabber = FrameGrabber(picam2)
+            grabber.start()
+            continue
+
+    # Newest frame from the grabber thread
+    frame = grabber.read()
     if frame is None:
         log("Frame grab failed – retrying next loop", "⚠️")
         continue
 
     # Apply mask
     if mask is not None:
-        frame_proc = cv2.bitwise_and(frame, frame, mask=mask)
+        roi = frame[roi_y0:roi_y1, roi_x0:roi_x1]
+        frame_proc = roi if mask_is_solid else cv2.bitwise_and(roi, roi, mask=mask)
     else:
         frame_proc = frame
 
     # YOLO detection
-    results = model(frame_proc, verbose=False, conf=DETECTION_CONF)
-    detections = []
-    for r in results:
-        for *box, conf, cls in r.boxes:
-            if int(cls) == 0:  # class 0 assumed boat
-                x1, y1, x2, y2 = map(int, box)
-                detections.append([x1, y1, x2, y2, float(conf)])
-    det_np = np.array(detections) if detections else np.empty((0, 5))
+    results = model(frame_proc, verbose=False, conf=DETECTION_CONF, imgsz=IMGSZ)
+    detections = [
+        boxes_to_detections(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy(),
+                            BOAT_CLASS_ID, roi_x0, roi_y0)
+        for r in results
+    ]
+    det_np = np.vstack(detections) if detections else np.empty((0, 5))
     tracks = mot_tracker.update(det_np)
 
     # Draw count line
@@ -165,35 +372,32 @@ while True:
     cv2.line(frame, (cx, 0), (cx, fh), (0, 0, 255), 2)
 
     # Process tracks
-    for *xyxy, tid in tracks:
-        x1, y1, x2, y2 = map(int, xyxy)
-        x_center = (x1 + x2) // 2
-        y_center = (y1 + y2) // 2
-
+    # Int boxes, IDs and centers for all tracks in one NumPy pass
+    tracks = tracks.astype(np.int32)
+    centers_x = (tracks[:, 0] + tracks[:, 2]) // 2
+    # Left → on/right transition of the line side with the cooldown expired, for all tracks at once
+    sides = np.sign(centers_x - cx).astype(np.int8)
+    slots = state.slots(tracks[:, 4].tolist(), sides.tolist())
+    prev_side = state.side[slots]
+    state.side[slots] = sides
+    counted = check_crossings(sides, prev_side, state.last_count[slots], now_mono, COOLDOWN_SEC)
+    state.last_count[slots[counted]] = now_mono
+
+    for x1, y1, x2, y2, tid in tracks.tolist():
         # Draw bounding box and ID
         cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(frame, str(int(tid)), (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-
-        prev_x = id_last_x.get(tid, x_center)
-        id_last_x[tid] = x_center
-
-        # Check crossing from left to right
-        crossed = prev_x < cx <= x_center
-        if crossed:
-            last_ts = last_count.get(tid, 0)
-            if now.timestamp() - last_ts >= COOLDOWN_SEC:
-                boat_total += 1
-                last_count[tid] = now.timestamp()
-                log(f"Boat #{{boat_total}} detected (track {{int(tid)}})", "🚤")
-                # Snapshot
-                snap_path = os.path.join(SNAPSHOT_DIR, f"boat_{{boat_total}}_{{int(tid)}}.jpg")
-                cv2.imwrite(snap_path, frame)
-                # Google Sheets append
-                if sheet is not None:
-                    try:
-                        sheet.append_row([now.isoformat(), boat_total, int(tid), snap_path])
-                    except Exception as e:
-                        log(f"Sheets append error: {{e}}", "⚠️")
+        cv2.putText(frame, str(tid), (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+    for tid in tracks[counted, 4].tolist():   # only the tracks that just crossed
+        boat_total += 1
+        now = datetime.now(TIMEZONE)   # wall-clock time for the Sheets row
+        log(f"Boat #{boat_total} detected (track {tid})", "🚤")
+        # Snapshot (copy: the frame keeps being drawn on while the encoder runs)
+        snap_path = os.path.join(SNAPSHOT_DIR, f"boat_{boat_total}_{tid}.jpg")
+        io_pool.submit(cv2.imwrite, snap_path, frame.copy(), [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY])
+        # Google Sheets append
+        if sheet is not None:
+            queue_sheet_row([now.isoformat(), boat_total, tid, snap_path])
 
     # Display
     cv2.imshow("Boat Counter", frame)
@@ -202,5 +406,20 @@ while True:
 
 # === CLEANUP ===============================================================
 log("Exiting – cleaning up", "🛑")
+grabber.stop()
 picam2.stop()
+io_pool.shutdown(wait=True)
+if sheet_thread:
+    sheet_q.put(None)                      # flush remaining rows
+    sheet_thread.join(timeout=30)
+    leftover = []
+    while True:
+        try:
+            row = sheet_q.get_nowait()
+        except Empty:
+            break
+        if row is not None:
+            leftover.append(row)
+    if leftover:
+        save_backlog(leftover)
 cv2.destroyAllWindows()
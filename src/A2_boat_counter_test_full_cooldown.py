@@ -18,9 +18,12 @@ Date: 07/09/2025
 # === IMPORTS SECTION ===
 import cv2  # OpenCV for video processing and GUI
 import numpy as np  # For array and matrix operations
-import math  # For rounding and math functions
 import time  # For timing and delays
 import os  # For file and directory operations
+import threading  # For the background frame reader
+from concurrent.futures import ThreadPoolExecutor  # Off-thread snapshot writes
+from queue import Queue, Full, Empty  # Bounded frame queue between reader and main loop
+from collections import defaultdict  # Per-ID history allocated on first use
 from datetime import datetime  # For timestamps
 from ultralytics import YOLO  # YOLOv8 object detection model
 from sort import *  # SORT tracker for object tracking
@@ -39,13 +42,26 @@ except ValueError:
     print(f"[⚠️] Invalid video index: {video_index}, using default: 0")
 
 MODEL_PATH = "yolov8n.pt"         # Path to YOLOv8 model file
+ENGINE_PATH = "yolov8n.engine"    # TensorRT FP16 engine exported from MODEL_PATH (preferred when present)
 CLASS_FILTER = "boat"             # Only detect and count boats
 CONFIDENCE_THRESHOLD = 0.15        # Minimum confidence for detection
+IOU_THRESHOLD = 0.45              # NMS overlap threshold
+IMGSZ = 640                       # YOLO input width; wider frames are downscaled once before inference
+MOTION_THRESH = 2.0               # Mean gray-level change (0-255) below which YOLO is skipped (0 = always run)
 SNAPSHOT_DIR = "snapshots"        # Directory to save boat snapshots
+SNAPSHOT_PAD = 20                 # Pixels of context kept around the boat in snapshots
+SNAPSHOT_JPEG_QUALITY = 80        # JPEG quality for snapshots (smaller, faster encode)
 GSHEET_CREDS_FILE = "gsheets_creds.json"  # Google Sheets service account file
 GOOGLE_SHEET_NAME = "Boat Counter Logs"   # Name of the Google Sheet
 COOLDOWN_SECONDS = 5  # Cooldown per boat ID to prevent duplicates
+STALE_ID_SECONDS = 300  # Forget IDs the tracker hasn't reported for this long
+PRUNE_EVERY_FRAMES = 1000  # How often to sweep stale IDs out of the tracking dicts
+SHEET_BATCH_ROWS = 10  # Send queued Google Sheets rows once this many are waiting...
+SHEET_FLUSH_SECONDS = 5  # ...or once the oldest has waited this long
 DISPLAY_WINDOW = False  # Set to False when running in Docker/headless mode
+BATCH_SIZE = 8  # Frames per YOLO call (raise on GPUs with spare VRAM, 1 = per-frame)
+FRAME_QUEUE_SIZE = 4  # Decoded frames the reader thread may buffer ahead of inference
+LIVE_SOURCE = isinstance(VIDEO_SOURCE, int)  # Camera index: drop stale frames; video file: keep every frame
 
 # === SETUP GOOGLE SHEETS CONNECTION ===
 sheet = None  # Will hold the Google Sheet object if connection is successful
@@ -62,132 +78,278 @@ try:
 except Exception as e:
     print(f"[⚠️ WARN] Google Sheets not connected: {e}")  # Print warning if connection fails
 
+sheet_q = Queue()  # Rows waiting to be appended to the Google Sheet; None stops the writer
+
+def sheet_writer():
+    """Append queued rows to the Google Sheet in batches so network latency stays off the frame loop."""
+    rows = []  # Rows collected for the next append_rows call
+    deadline = None  # When the current batch must be sent
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)  # Wait briefly for the next row
+            if row is None:  # Shutdown: flush what we have and exit
+                stop = True
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SECONDS
+        except Empty:
+            pass
+        if rows and (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            try:
+                sheet.append_rows(rows)  # One HTTPS round-trip for the whole batch
+            except Exception as e:
+                print(f"[❌ ERROR] Google Sheets write failed ({len(rows)} rows): {e}")  # Print error if logging fails
+            rows, deadline = [], None
+
+sheet_thread = None  # Background writer, only started when Sheets is connected
+if sheet:
+    sheet_thread = threading.Thread(target=sheet_writer, name="sheet-writer", daemon=True)
+    sheet_thread.start()
+
+# === FRAME RESIZING ===
+def fit_to_imgsz(frame, interpolation=cv2.INTER_AREA):
+    """Downscale frames wider than IMGSZ so YOLO's letterbox has nothing left to shrink."""
+    h, w = frame.shape[:2]
+    if w <= IMGSZ:
+        return frame  # Already small enough; never upscale
+    return cv2.resize(frame, (IMGSZ, int(h * IMGSZ / w)), interpolation=interpolation)
+
 # === OPTIONAL MASK LOADING ===
 mask = None  # Will hold the binary mask if available
+roi_x0, roi_y0 = 0, 0  # Top-left of the mask's bounding box (added back to YOLO boxes)
 if os.path.exists("mask.png"):  # Check if mask file exists
     mask = cv2.imread("mask.png", cv2.IMREAD_GRAYSCALE)  # Load mask as grayscale
+    mask = fit_to_imgsz(mask, cv2.INTER_NEAREST)  # Match the downscaled frames
     mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]  # Ensure mask is binary (0 or 255)
+    ys, xs = np.nonzero(mask)  # Pixels inside the region of interest
+    if ys.size:  # Crop YOLO input to the mask's bounding box
+        roi_y0, roi_y1 = int(ys.min()), int(ys.max()) + 1
+        roi_x0, roi_x1 = int(xs.min()), int(xs.max()) + 1
+    else:  # Empty mask: keep the full frame (everything is masked out anyway)
+        roi_y1, roi_x1 = mask.shape
+    mask_crop = mask[roi_y0:roi_y1, roi_x0:roi_x1]  # Mask restricted to its bounding box
     print("[🧭] Mask loaded successfully.")  # Print success message
 else:
     print("[ℹ️] No mask found – using full frame.")  # Print info if no mask
 
+def apply_mask(frame):
+    """Crop frame to the mask's bounding box and black out pixels outside the mask."""
+    if mask is None:
+        return frame  # No mask: YOLO sees the full frame
+    sub = frame[roi_y0:roi_y1, roi_x0:roi_x1]  # View of the ROI, no copy
+    return cv2.bitwise_and(sub, sub, mask=mask_crop)  # Mask only the ROI pixels
+
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)  # Ensure the snapshot directory exists
+snap_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")  # JPEG encode + disk write off the frame loop
 
 # === LOAD VIDEO AND MODEL ===
 cap = cv2.VideoCapture(VIDEO_SOURCE)  # Open the video file
 cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)  # Set width for consistency
 cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)  # Set height for consistency
+if LIVE_SOURCE:
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Driver keeps only the newest frame; the reader queue does the rest
 
 frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))  # Get frame width
 frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))  # Get frame height
+if frame_width > IMGSZ:  # Frames are downscaled to IMGSZ wide before processing
+    frame_width, frame_height = IMGSZ, int(frame_height * IMGSZ / frame_width)
 line_x = frame_width // 2  # Place the line at 1/2 of the frame width
 COUNT_LINE = [line_x, 0, line_x, frame_height]  # Vertical red line from top to bottom
 
-model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+if not os.path.exists(ENGINE_PATH):  # One-time TensorRT export (needs an NVIDIA GPU + TensorRT)
+    try:
+        YOLO(MODEL_PATH).export(format="engine", imgsz=IMGSZ, half=True, dynamic=True, batch=BATCH_SIZE)  # Writes ENGINE_PATH next to the .pt
+        print(f"[⚡] Exported TensorRT engine to {ENGINE_PATH}")  # Print export message
+    except Exception as e:
+        print(f"[ℹ️] TensorRT export unavailable, using PyTorch weights: {e}")  # Fall back to eager PyTorch
+if os.path.exists(ENGINE_PATH):
+    model = YOLO(ENGINE_PATH, task="detect")  # Load TensorRT FP16 engine for detection
+else:
+    model = YOLO(MODEL_PATH)  # Load YOLOv8 model for detection
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)  # Class index of CLASS_FILTER (resolved once)
+if BOAT_CLASS_ID is None:  # Model was not trained on the class we want to count
+    raise SystemExit(f"[❌ ERROR] Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 tracker = Sort(max_age=30, min_hits=3, iou_threshold=0.4)  # Initialize object tracker
 
 # === TRACKING VARIABLES ===
 totalCount = []      # List of unique counted boat IDs
 counted_ids = set()  # Set of IDs that have already been counted (prevents double-counting)
-id_history = {}      # Dictionary to store the last N centroids for each ID
 last_count_time = {} # Dictionary to store the last count time for each ID
+last_seen = {}       # Dictionary to store when each ID was last tracked
+frame_count = 0      # Frames processed, drives the periodic stale-ID sweep
+
+# === CENTROID HISTORY (ring buffers, one array per coordinate) ===
+HISTORY_LEN = 15  # Number of recent centroids kept per ID
+hist_xy = defaultdict(lambda: np.zeros((2, HISTORY_LEN), np.int16))  # ID -> ring buffer, row 0 = x, row 1 = y
+hist_count = defaultdict(int)  # ID -> total centroids written (slot = count % HISTORY_LEN)
+
+def push_center(id, cx, cy):
+    """Write a centroid into the ID's ring buffer, overwriting the oldest point once full."""
+    k = hist_count[id]
+    hist_xy[id][:, k % HISTORY_LEN] = (cx, cy)  # New IDs get their buffer allocated here
+    hist_count[id] = k + 1
+
+def history(id):
+    """The ID's valid centroids as a (2, n) array of x and y rows, oldest first."""
+    k = hist_count[id]
+    if k <= HISTORY_LEN:  # Not wrapped yet: points are already in order
+        return hist_xy[id][:, :k]
+    head = k % HISTORY_LEN
+    return np.concatenate((hist_xy[id][:, head:], hist_xy[id][:, :head]), axis=1)  # Unroll from the oldest slot
+
+def prune_stale_ids(now):
+    """Drop per-ID state for tracks unseen for STALE_ID_SECONDS so long runs don't leak memory."""
+    stale = [k for k, t in last_seen.items() if now - t > STALE_ID_SECONDS]
+    for k in stale:
+        hist_xy.pop(k, None)
+        hist_count.pop(k, None)
+        last_count_time.pop(k, None)
+        last_seen.pop(k, None)
+        counted_ids.discard(k)
+
+# === MOTION GATE ===
+motion_bg = None  # Running-average background thumbnail (float32)
+
+def has_motion(frame):
+    """Cheap frame-diff gate: compare a 160x90 gray thumbnail of the ROI against a running background."""
+    global motion_bg
+    gray = cv2.cvtColor(cv2.resize(frame, (160, 90), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)  # Tiny gray thumbnail
+    if motion_bg is None:  # First frame: seed the background and run YOLO
+        motion_bg = gray.astype(np.float32)
+        return True
+    motion = cv2.absdiff(gray, cv2.convertScaleAbs(motion_bg)).mean()  # Average change vs background
+    cv2.accumulateWeighted(gray, motion_bg, 0.02)  # Slowly adapt to lighting/waves
+    return motion >= MOTION_THRESH
+
+# === BACKGROUND FRAME READER ===
+frame_q = Queue(maxsize=FRAME_QUEUE_SIZE)  # Frames decoded ahead of inference
+reader_running = threading.Event()  # Cleared to stop the reader thread
+reader_running.set()
+
+def read_frames():
+    """Decode frames from cap into frame_q so capture overlaps inference; None marks end of stream."""
+    while reader_running.is_set():
+        success, frame = cap.read()  # Read a frame from the video
+        item = fit_to_imgsz(frame) if success else None  # None tells the main loop the stream ended
+        while reader_running.is_set():
+            try:
+                frame_q.put(item, timeout=0.1)  # Hand frame to the main loop
+                break
+            except Full:
+                if LIVE_SOURCE:  # Drop the oldest frame so live video stays current
+                    try:
+                        frame_q.get_nowait()
+                    except Empty:
+                        pass
+        if item is None:
+            return
+
+reader = threading.Thread(target=read_frames, name="frame-reader", daemon=True)  # Capture runs beside YOLO
 
 print("[🎥] Starting boat detection test. Press 'Q' to exit.")  # Print start message
+reader.start()  # Start decoding frames in the background
 
 # === MAIN LOOP ===
-while True:  # Loop over video frames
-    success, img = cap.read()  # Read a frame from the video
-    if not success:  # If no frame is read (end of video)
+frame_buf = []  # Frames waiting for the next batched YOLO call
+running = True  # Cleared when the video ends or 'Q' is pressed
+while running:  # Loop over batches of video frames
+    img = frame_q.get()  # Wait for the next decoded frame
+    if img is not None:
+        masked = apply_mask(img)  # Apply mask if available
+        frame_buf.append((img, masked, has_motion(masked)))  # Queue frame for the next batch
+        if len(frame_buf) < BATCH_SIZE:  # Keep reading until the batch is full
+            continue
+    else:  # If no frame is read (end of video)
         print("[✅] Finished processing video.")  # Print finished message
-        break  # Exit loop
-
-    imgMasked = cv2.bitwise_and(img, img, mask=mask) if mask is not None else img  # Apply mask if available
-
-    detections = np.empty((0, 5))  # Prepare empty array for detections
-    results = model(imgMasked, stream=True)  # Run YOLO on the frame
-    for r in results:  # Loop over detection results
-        for box in r.boxes:  # Loop over detected boxes
-            x1, y1, x2, y2 = map(int, box.xyxy[0])  # Extract bounding box coordinates
-            conf = math.ceil((box.conf[0] * 100)) / 100  # Round confidence
-            cls = int(box.cls[0])  # Get class index
-            currentClass = model.names[cls]  # Get class name
-            if currentClass == CLASS_FILTER and conf > CONFIDENCE_THRESHOLD:  # Filter by class and confidence
-                detections = np.vstack((detections, [x1, y1, x2, y2, conf]))  # Add detection to array
-
-    # Handle empty detections array properly
-    if len(detections) == 0:
-        resultsTracker = np.empty((0, 5))
-    else:
-        resultsTracker = tracker.update(detections)  # Track detected objects
-        
-    for result in resultsTracker:  # Loop over tracked objects
-        x1, y1, x2, y2, id = map(int, result)  # Get bounding box and ID
-        cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2  # Center of the box
-        center = (cx, cy)  # Store center as tuple
-
-        if id not in id_history:  # If ID not in history, initialize list
-            id_history[id] = []
-        id_history[id].append(center)  # Add current center to history
-        if len(id_history[id]) > 15:  # Keep only last 15 points
-            id_history[id] = id_history[id][-15:]
-
-        if len(id_history[id]) >= 2:  # If enough history to check movement
-            x_positions = [pt[0] for pt in id_history[id]]  # Get all x positions
-            direction = "Right" if x_positions[-1] > x_positions[0] else "Left"  # Determine direction
-            crossed = any(  # Check if the line was crossed in either direction
-                (x_positions[i] < COUNT_LINE[0] < x_positions[i + 1]) or
-                (x_positions[i] > COUNT_LINE[0] > x_positions[i + 1])
-                for i in range(len(x_positions) - 1)
-            )
-            distance = abs(x_positions[-1] - x_positions[0])  # Distance moved
-
-            now = time.time()  # Get current time
-            recent = last_count_time.get(id, 0)  # Get last count time for this ID
-            if crossed and distance > 15 and (now - recent) > COOLDOWN_SECONDS:  # If crossed, moved enough, and cooldown passed
-                counted_ids.add(id)  # Mark as counted
-                last_count_time[id] = now  # Update last count time
-                totalCount.append(id)  # Add to total count
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')  # Get timestamp
-                print(f"[✅] Boat #{id} counted at {timestamp} going {direction}")  # Print count message
-                filename = f"boat_{timestamp}.jpg"  # Filename for snapshot
-                filepath = os.path.join(SNAPSHOT_DIR, filename)  # Full path
-                cv2.imwrite(filepath, img)  # Save the frame as an image
-                if sheet:  # If Google Sheets is connected
-                    try:
-                        sheet.append_row([
-                            datetime.now().strftime('%Y-%m-%d'),  # Date
-                            datetime.now().strftime('%H:%M:%S'),  # Time
-                            len(totalCount),                      # Total count
-                            filename,                             # Image filename
-                            direction                             # Direction
-                        ])
-                    except Exception as e:
-                        print(f"[❌ ERROR] Google Sheets write failed: {e}")  # Print error if logging fails
+        running = False  # Flush the partial batch below, then exit
+        if not frame_buf:
+            break
 
-        if id in id_history and len(id_history[id]) >= 2:  # If enough history to determine direction
-            direction = "Right" if id_history[id][-1][0] > id_history[id][0][0] else "Left"  # Determine direction
+    masked_buf = [masked for _, masked, moving in frame_buf if moving]  # Only frames with motion go to YOLO
+    results = iter(model.predict(masked_buf, classes=[BOAT_CLASS_ID], conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD,
+                                 imgsz=IMGSZ, verbose=False, stream=False) if masked_buf else ())  # Run YOLO once on the whole batch, boats only
+
+    for img, _, moving in frame_buf:  # Process frames in capture order (SORT is stateful)
+        boxes = next(results).boxes if moving else None  # Idle frames have no detections
+        if boxes is None or len(boxes) == 0:  # Nothing detected in this frame
+            detections = np.empty((0, 5), np.float32)
         else:
-            direction = "???"  # Not enough info to determine
+            xyxy = boxes.xyxy.cpu().numpy() + (roi_x0, roi_y0, roi_x0, roi_y0)  # All boxes in one GPU→CPU copy, shifted to full-frame coordinates
+            conf = boxes.conf.cpu().numpy()  # All confidences
+            detections = np.hstack([xyxy, conf[:, None]]).astype(np.float32)  # Rows of [x1, y1, x2, y2, conf], already class/conf filtered
+
+        resultsTracker = tracker.update(detections)  # Every frame, even empty ones, so lost tracks age out
+
+        now = time.time()  # Get current time
+        frame_count += 1
+        if frame_count % PRUNE_EVERY_FRAMES == 0:  # Periodically forget IDs that left the scene
+            prune_stale_ids(now)
+
+        for result in resultsTracker:  # Loop over tracked objects
+            x1, y1, x2, y2, id = map(int, result)  # Get bounding box and ID
+            last_seen[id] = now  # Track is still alive
+            cx, cy = x1 + (x2 - x1) // 2, y1 + (y2 - y1) // 2  # Center of the box
+            push_center(id, cx, cy)  # Add current center to history (oldest is overwritten)
 
-        # Draw visualizations (only if display is enabled)
+            direction = "???"  # Not enough info to determine yet
+            if hist_count[id] >= 2:  # If enough history to check movement
+                x_positions = history(id)[0].astype(np.int32)  # x positions oldest->newest (int32 so products can't overflow)
+                direction = "Right" if x_positions[-1] > x_positions[0] else "Left"  # Determine direction
+                offsets = x_positions - COUNT_LINE[0]  # Signed distance of each point from the line
+                crossed = bool(np.any(offsets[:-1] * offsets[1:] < 0))  # Sign change between consecutive points = line crossed
+                distance = abs(int(x_positions[-1] - x_positions[0]))  # Distance moved
+
+                recent = last_count_time.get(id, 0)  # Get last count time for this ID
+                if crossed and distance > 15 and (now - recent) > COOLDOWN_SECONDS:  # If crossed, moved enough, and cooldown passed
+                    counted_ids.add(id)  # Mark as counted
+                    last_count_time[id] = now  # Update last count time
+                    totalCount.append(id)  # Add to total count
+                    count_time = datetime.now()  # One clock read for the filename and the sheet row
+                    timestamp = count_time.strftime('%Y%m%d_%H%M%S')  # Get timestamp
+                    print(f"[✅] Boat #{id} counted at {timestamp} going {direction}")  # Print count message
+                    filename = f"boat_{timestamp}.jpg"  # Filename for snapshot
+                    filepath = os.path.join(SNAPSHOT_DIR, filename)  # Full path
+                    crop = img[max(0, y1 - SNAPSHOT_PAD):max(0, y2 + SNAPSHOT_PAD), max(0, x1 - SNAPSHOT_PAD):max(0, x2 + SNAPSHOT_PAD)]  # Boat plus a margin
+                    crop = crop.copy() if crop.size else img.copy()  # Copy so later drawing can't touch it
+                    snap_pool.submit(cv2.imwrite, filepath, crop, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_JPEG_QUALITY])  # Save the snapshot in the background
+                    if sheet:  # If Google Sheets is connected, hand the row to the background writer
+                        sheet_q.put([
+                            count_time.strftime('%Y-%m-%d'),  # Date
+                            count_time.strftime('%H:%M:%S'),  # Time
+                            len(totalCount),                  # Total count
+                            filename,                         # Image filename
+                            direction                         # Direction
+                        ])
+
+            # Draw visualizations (only if display is enabled)
+            if DISPLAY_WINDOW:
+                cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)  # Bounding box
+                cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)  # ID and direction
+                cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)  # Center point
+                trail = history(id).T.astype(np.int32).reshape(-1, 1, 2)  # (n, 1, 2) point list for OpenCV
+                cv2.polylines(img, [trail], False, (0, 255, 255), 2)  # Trajectory in one call
+
+        # Only add visualization if display is enabled
         if DISPLAY_WINDOW:
-            cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 2)  # Bounding box
-            cv2.putText(img, f"ID: {id} {direction}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)  # ID and direction
-            cv2.circle(img, (cx, cy), 5, (0, 255, 255), -1)  # Center point
-            for pt in id_history[id]:
-                cv2.circle(img, pt, 2, (0, 255, 255), -1)  # Trajectory
-
-    # Only add visualization if display is enabled
-    if DISPLAY_WINDOW:
-        cv2.line(img, (COUNT_LINE[0], COUNT_LINE[1]), (COUNT_LINE[2], COUNT_LINE[3]), (0, 0, 255), 2)  # Counting line
-        cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)  # Total count
-        cv2.putText(img, "Press Q to quit", (img.shape[1] - cv2.getTextSize("Press Q to quit", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0][0] - 20, img.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
-
-        cv2.imshow("Boat Detection Test", img)  # Show the frame
-        if cv2.waitKey(1) & 0xFF == ord("q"):  # Wait for 'q' key to quit
-            break
+            cv2.line(img, (COUNT_LINE[0], COUNT_LINE[1]), (COUNT_LINE[2], COUNT_LINE[3]), (0, 0, 255), 2)  # Counting line
+            cv2.putText(img, f"Total: {len(totalCount)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)  # Total count
+            cv2.putText(img, "Press Q to quit", (img.shape[1] - cv2.getTextSize("Press Q to quit", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0][0] - 20, img.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+
+            cv2.imshow("Boat Detection Test", img)  # Show the frame
+            if cv2.waitKey(1) & 0xFF == ord("q"):  # Wait for 'q' key to quit
+                running = False  # Stop reading further batches
+                break
+
+    frame_buf = []  # Start a fresh batch
 
+reader_running.clear()  # Stop the reader thread
+reader.join(timeout=1)  # Let it finish its current read before releasing the camera
 cap.release()  # Release the video capture
+snap_pool.shutdown(wait=True)  # Finish writing pending snapshots
+if sheet_thread:
+    sheet_q.put(None)  # Ask the writer to flush remaining rows
+    sheet_thread.join(timeout=10)  # Give the final append a chance to finish
 if DISPLAY_WINDOW:
     cv2.destroyAllWindows()  # Close all OpenCV windows
 print(f"[🏁 DONE] Final boat count: {len(totalCount)}")  # Print final count
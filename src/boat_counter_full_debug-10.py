@@ -18,19 +18,38 @@ Works on pi
 from __future__ import annotations  # Future annotations for type hints
 
 # ───────────────────────── Imports ─────────────────────────
+import os  # Thread-count environment, CPU count
+os.environ.setdefault("OMP_NUM_THREADS", "4")  # Inference threads (torch/NCNN OpenMP) — one per Pi core
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")  # NumPy's arrays here are tiny; no BLAS pool needed
 import logging  # Logging module
-from logging.handlers import RotatingFileHandler  # Rotating file handler for logs
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener  # File rotation, off-thread logging
+import atexit  # Flush queued log records on exit
 import sys  # System-specific parameters and functions
 import time  # Time access and conversions
+import threading  # Background camera reader
+from queue import Queue, Full, Empty  # Frame, snapshot, Sheets and log queues
 from datetime import datetime  # Date and time handling
 from zoneinfo import ZoneInfo  # Timezone support
 from pathlib import Path  # Filesystem path handling
-from typing import Optional, Dict, Tuple, List  # Type hinting
+from typing import Optional, Tuple, List  # Type hinting
 
 import cv2  # OpenCV for computer vision
 import numpy as np  # NumPy for numerical operations
+import torch  # Tensor input for the pre-letterboxed batch
 from ultralytics import YOLO  # YOLO object detection
 
+try:
+    from numba import njit, prange           # JIT for the letterbox and crossing kernels; optional
+    NUMBA_OK = True
+except ImportError:
+    NUMBA_OK = False  # Ultralytics does its own preprocessing instead
+    prange = range
+
+    def njit(*args, **kwargs):               # no numba: decorator is a no-op
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
 try:
     from picamera2 import Picamera2          # Pi camera; optional
 except ImportError:
@@ -48,19 +67,44 @@ except ImportError:
 # ───────────────────────── Config ──────────────────────────
 TZ                = ZoneInfo("America/Denver")  # Timezone
 MODEL_PATH        = "yolov8n.pt"          # nano model is lightest
+NCNN_PATH         = Path("yolov8n_ncnn_model")  # NCNN export of MODEL_PATH (NEON kernels), built on first run
+IMGSZ             = 320                   # YOLO input size; delete NCNN_PATH after changing
+CLASS_FILTER      = "boat"                # COCO class 8 in the stock weights
 VIDEO_SOURCE      = 0 #"test_pattern.mp4" # camera index or video file
 FRAME_W, FRAME_H  = 640, 360  # Frame width and height
 COUNT_LINE_RATIO  = 0.5                   # 50 % of width
 CONF_THRESHOLD    = 0.35  # Confidence threshold for detection
+NMS_IOU           = 0.45                  # NMS overlap threshold
+MAX_DET           = 20                    # boats per frame kept after NMS
 COOLDOWN_SEC      = 5                     # per‑ID throttle
 SNAPSHOT_DIR      = Path("snapshots")  # Directory for snapshots
+SNAPSHOT_QUALITY  = 85                    # JPEG quality for snapshots
 LOG_DIR           = Path("logs")  # Directory for logs
 GSHEET_JSON       = "gsheets_creds.json"  # Google Sheets credentials file
 GSHEET_NAME       = "Boat Counter Logs"  # Google Sheets name
+SHEET_BATCH_ROWS  = 50                    # flush queued sheet rows at this many…
+SHEET_FLUSH_SEC   = 10                    # …or once the oldest has waited this long
+SHEET_RETRIES     = 3                     # attempts per flush before the rows wait for the next one
+SHEET_MAX_PENDING = 1000                  # oldest unsent rows are dropped beyond this
 MASK_PATH         = "mask.png"            # optional binary mask
+MASK_SOLID_COVERAGE = 0.95                # mask covering more of its bounding box than this is a crop only
 DISPLAY_WINDOW    = False                 # False to run headless
 MAX_CAMERA_RETRY  = 5  # Max camera retries
 RETRY_BACKOFF_SEC = 2  # Retry backoff in seconds
+DAY_CHECK_SEC     = 60                    # seconds between day/night checks (wall clock only read then)
+NUMBA_PREPROCESS  = True                  # letterbox + normalize with the numba kernel when numba is installed
+BATCH_FRAMES      = 2                     # frames per YOLO forward pass (PyTorch weights only)
+BATCH_WAIT_SEC    = 0.08                  # run a part-filled batch once its first frame is this old
+MOTION_SIZE       = (80, 45)              # thumbnail the motion gate compares
+MOTION_PIXEL_DIFF = 15                    # grey-level change that counts a thumbnail pixel as moving
+MOTION_MIN_PIX    = 20                    # fewer moving pixels than this (and no tracks) skips YOLO
+MOTION_EMA        = 0.1                   # background update rate for the motion gate
+CV_THREADS        = 2                     # OpenCV pool; its work here is small next to inference
+INFER_THREADS     = min(4, os.cpu_count() or 1)  # PyTorch intra-op threads
+
+cv2.setUseOptimized(True)  # SIMD (NEON/AVX) kernels
+cv2.setNumThreads(CV_THREADS)  # Cap OpenCV's pool so it doesn't fight inference for cores
+torch.set_num_threads(INFER_THREADS)  # PyTorch fallback path
 
 for d in (SNAPSHOT_DIR, LOG_DIR):
     d.mkdir(exist_ok=True)  # Ensure directories exist
@@ -74,10 +118,14 @@ def _setup_logger() -> logging.Logger:
                             "%Y-%m-%d %H:%M:%S")  # Log format
     sh = logging.StreamHandler(sys.stdout)  # Stream handler for console
     sh.setFormatter(fmt)  # Set format for stream handler
-    lg.addHandler(sh)  # Add stream handler to logger
     fh = RotatingFileHandler(LOG_DIR / "boat_counter.log", maxBytes=5_000_000, backupCount=3)
     fh.setFormatter(fmt)  # Set format for file handler
-    lg.addHandler(fh)  # Add file handler to logger
+    # Callers only enqueue records; a listener thread formats them and does the console/file I/O
+    q: Queue = Queue(-1)  # Unbounded, so logging never blocks
+    lg.addHandler(QueueHandler(q))  # Only handler on the logger
+    listener = QueueListener(q, sh, fh, respect_handler_level=True)  # Drains the queue to both handlers
+    listener.start()  # Start the listener thread
+    atexit.register(listener.stop)  # Write out queued records on any exit
     return lg  # Return configured logger
 
 log = _setup_logger()  # Initialize logger
@@ -105,10 +153,16 @@ except ImportError as e1:
 # ──────────── Sunrise / Sunset helper ─────────────
 _city = astral.LocationInfo(latitude=38.833, longitude=-104.821, timezone=str(TZ))  # City info
 
+_sun_day = None  # Date the cached dawn/dusk belong to
+_dawn = _dusk = None  # Cached dawn/dusk for _sun_day
+
 def is_daytime(ts: Optional[datetime] = None) -> bool:
+    global _sun_day, _dawn, _dusk
     ts = ts or datetime.now(TZ)  # Use current time if not provided
-    sun = astral_sun.sun(_city.observer, date=ts.date(), tzinfo=TZ)  # Get sun times
-    return sun["dawn"] <= ts <= sun["dusk"]  # Return True if daytime
+    if ts.date() != _sun_day:  # Astral only once per day
+        sun = astral_sun.sun(_city.observer, date=ts.date(), tzinfo=TZ)  # Get sun times
+        _sun_day, _dawn, _dusk = ts.date(), sun["dawn"], sun["dusk"]  # Cache for the rest of the day
+    return _dawn <= ts <= _dusk  # Return True if daytime
 
 # ───────────── Google Sheets (optional) ────────────
 
@@ -143,12 +197,16 @@ class Camera:
             try:
                 if Picamera2 is not None and isinstance(self.source, int):
                     self.picam2 = Picamera2()  # Initialize PiCamera2
+                    # libcamera's "RGB888" is B,G,R in memory — the layout OpenCV draws on and Ultralytics
+                    # expects — so frames go straight to YOLO ("BGR888" would need a channel swap)
                     self.picam2.configure(self.picam2.create_video_configuration(
                         main={"size": (FRAME_W, FRAME_H), "format": "RGB888"}))  # Configure camera
                     self.picam2.start()  # Start camera
                     log.info("PiCamera2 started")  # Log start
                     return  # Return if successful
                 self.cap = cv2.VideoCapture(self.source)  # OpenCV video capture
+                if isinstance(self.source, int):
+                    self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Don't queue stale frames in the driver
                 self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_W)  # Set width
                 self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_H)  # Set height
                 if not self.cap.isOpened():
@@ -173,125 +231,388 @@ class Camera:
         if self.cap:
             self.cap.release()  # Release OpenCV capture
 
+
+class ThreadedCamera:
+    """Camera read on a background thread so capture overlaps YOLO inference."""
+
+    def __init__(self, source=VIDEO_SOURCE):
+        self._cam = Camera(source)  # Underlying camera, only touched by the reader thread
+        self._q: Queue = Queue(maxsize=1)  # Next (ok, frame) for the main loop
+        self._live = isinstance(source, int)  # Camera: drop stale frames; file: keep every frame
+        self._running = threading.Event()  # Cleared to stop the reader
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="camera-reader", daemon=True)
+        self._thread.start()  # Start reading
+
+    def _run(self):
+        while self._running.is_set():
+            item = self._cam.read()  # (ok, frame); each read returns a fresh array
+            while self._running.is_set():
+                try:
+                    self._q.put(item, timeout=0.1)  # Hand the frame over
+                    break
+                except Full:
+                    if self._live:  # Drop the oldest so latest() always serves the newest frame
+                        try:
+                            self._q.get_nowait()
+                        except Empty:
+                            pass
+            if not item[0]:
+                time.sleep(0.1)  # Don't spin on a failing camera
+
+    def latest(self, timeout: float = 2.0) -> Tuple[bool, Optional[np.ndarray]]:
+        try:
+            return self._q.get(timeout=timeout)  # Wait for the next frame
+        except Empty:
+            return False, None  # Reader stalled — treat as a failed grab
+
+    def release(self):
+        self._running.clear()  # Ask the reader to exit
+        self._thread.join(timeout=1)  # Let it finish its current read
+        self._cam.release()  # Release camera
+
 # ───────────────────── ROI Mask load ─────────────────────
-MASK: Optional[np.ndarray]
+ROI_X0, ROI_Y0, ROI_X1, ROI_Y1 = 0, 0, None, None  # Mask bounding box; YOLO only sees this region
+MASK: Optional[np.ndarray] = None  # (h, w, 1) bool mask over the ROI; None when the crop alone is enough
 if Path(MASK_PATH).exists():
     _mask = cv2.imread(MASK_PATH, cv2.IMREAD_GRAYSCALE)  # Read mask image
-    MASK = cv2.threshold(_mask, 127, 255, cv2.THRESH_BINARY)[1]  # Threshold mask
-    log.info("Mask loaded")  # Log mask loaded
+    _mask = cv2.threshold(_mask, 127, 255, cv2.THRESH_BINARY)[1]  # Threshold mask
+    ys, xs = np.nonzero(_mask)  # Mask pixels
+    if ys.size:
+        ROI_X0, ROI_Y0, ROI_X1, ROI_Y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    _mask = _mask[ROI_Y0:ROI_Y1, ROI_X0:ROI_X1]  # Crop mask to its bounding box
+    if cv2.countNonZero(_mask) <= MASK_SOLID_COVERAGE * _mask.size:
+        MASK = (_mask > 0)[..., None]  # Broadcasts over the colour channels
+    log.info(f"Mask loaded — YOLO sees ROI ({ROI_X0}, {ROI_Y0}, {ROI_X1}, {ROI_Y1})")  # Log mask loaded
 else:
-    MASK = None  # No mask
     log.info("No mask — using full frame")  # Log no mask
+ROI_OFFSET = np.array([ROI_X0, ROI_Y0, ROI_X0, ROI_Y0], np.float32)  # Added to YOLO's xyxy boxes
 
 # ─────────────── YOLO & Tracker init ───────────────
+if not NCNN_PATH.exists():
+    try:
+        log.info(f"Exporting {MODEL_PATH} to NCNN (one-time)…")  # Log export
+        YOLO(MODEL_PATH).export(format="ncnn", imgsz=IMGSZ)  # Writes NCNN_PATH next to the weights
+    except Exception as e:
+        log.warning(f"NCNN export failed — using PyTorch weights: {e}")  # Fall back to .pt
 log.info("Loading YOLOv8 model…")  # Log model loading
-model = YOLO(MODEL_PATH)  # Load YOLO model
+model = YOLO(str(NCNN_PATH), task="detect") if NCNN_PATH.exists() else YOLO(MODEL_PATH)  # Load YOLO model
+BATCH = 1 if NCNN_PATH.exists() else BATCH_FRAMES  # Ultralytics' NCNN backend only runs the first image of a batch
+BOAT_CLASS_ID = next((k for k, v in model.names.items() if v == CLASS_FILTER), None)  # Class index to keep
+if BOAT_CLASS_ID is None:
+    raise SystemExit(f"Class '{CLASS_FILTER}' not in model classes: {sorted(model.names.values())}")
 tracker = Sort(max_age=15, min_hits=3, iou_threshold=0.1)  # Initialize tracker
 
+# ───────────────────── YOLO preprocessing ─────────────────────
+LETTERBOX_FILL = 114 / 255  # Ultralytics' grey padding value
+
+@njit(parallel=True, fastmath=True, cache=True)
+def letterbox_norm(src, dst, scale, pad_x, pad_y):
+    """Bilinear-resize BGR uint8 *src* by *scale* into *dst* (3×S×S float32 RGB, 0–1) at (pad_x, pad_y)."""
+    h, w = src.shape[0], src.shape[1]
+    out_h, out_w = dst.shape[1], dst.shape[2]
+    new_h, new_w = int(round(h * scale)), int(round(w * scale))
+    for y in prange(out_h):
+        sy = min(max((y - pad_y + 0.5) / scale - 0.5, 0.0), h - 1.0)  # Source row (half-pixel centres)
+        y0 = int(sy)
+        y1 = min(y0 + 1, h - 1)
+        fy = sy - y0
+        for x in range(out_w):
+            if y < pad_y or y >= pad_y + new_h or x < pad_x or x >= pad_x + new_w:
+                for c in range(3):
+                    dst[c, y, x] = LETTERBOX_FILL  # Padding
+                continue
+            sx = min(max((x - pad_x + 0.5) / scale - 0.5, 0.0), w - 1.0)  # Source column
+            x0 = int(sx)
+            x1 = min(x0 + 1, w - 1)
+            fx = sx - x0
+            for c in range(3):
+                top = src[y0, x0, c] * (1.0 - fx) + src[y0, x1, c] * fx
+                bottom = src[y1, x0, c] * (1.0 - fx) + src[y1, x1, c] * fx
+                dst[2 - c, y, x] = (top * (1.0 - fy) + bottom * fy) / 255.0  # BGR → RGB, HWC → CHW
+
+
+_prep_buf = np.empty((BATCH, 3, IMGSZ, IMGSZ), np.float32)  # Reused letterboxed batch
+
+
+def preprocess(frames: List[np.ndarray]) -> Tuple[torch.Tensor, float, np.ndarray]:
+    """Letterbox *frames* (all one size) into a BCHW tensor; returns it with the box scale and offset to undo it."""
+    h, w = frames[0].shape[:2]
+    scale = min(IMGSZ / h, IMGSZ / w)  # Fit the long side
+    pad_x = (IMGSZ - int(round(w * scale))) // 2  # Centre the image
+    pad_y = (IMGSZ - int(round(h * scale))) // 2
+    for i, f in enumerate(frames):
+        letterbox_norm(f, _prep_buf[i], scale, pad_x, pad_y)  # Fill batch slot i
+    pad = np.array([pad_x, pad_y, pad_x, pad_y], np.float32)
+    return torch.from_numpy(_prep_buf[:len(frames)]), 1.0 / scale, ROI_OFFSET - pad / scale
+
+
+USE_NUMBA_PREPROCESS = NUMBA_PREPROCESS and NUMBA_OK  # Without numba the kernel would run as pure Python
+log.info(f"YOLO preprocessing: {'numba letterbox kernel' if USE_NUMBA_PREPROCESS else 'Ultralytics'}")
+
 # ───────────────── Snapshot & Sheets helpers ─────────────────
 
-def save_snapshot(frame: np.ndarray, tid: int):
+snap_q: Queue = Queue(maxsize=32)  # (path, crop) waiting to be encoded and written; None stops the writer
+
+
+def _snapshot_writer():
+    while True:
+        item = snap_q.get()  # Wait for the next snapshot
+        if item is None:
+            return  # Shutdown
+        path, crop = item
+        try:
+            ok, buf = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY])  # JPEG encode
+            if not ok:
+                raise RuntimeError("cv2.imencode failed")
+            path.write_bytes(buf.tobytes())  # Write to disk
+            log.debug(f"Snapshot saved {path.name}")  # Log snapshot saved
+        except Exception as e:
+            log.error(f"Snapshot {path.name} failed: {e}")  # Log error
+
+
+_snap_thread = threading.Thread(target=_snapshot_writer, name="snapshot-writer", daemon=True)
+_snap_thread.start()  # Encode and write snapshots off the frame loop
+
+
+def save_snapshot(frame: np.ndarray, box: Tuple[int, int, int, int], tid: int):
+    x1, y1, x2, y2 = box
+    x1, y1 = max(0, x1), max(0, y1)  # Clamp to the frame — negative indices would wrap around
+    x2, y2 = min(frame.shape[1], x2), min(frame.shape[0], y2)
+    if x2 <= x1 or y2 <= y1:
+        log.warning(f"Snapshot for track {tid} skipped — box outside frame")  # Nothing to encode
+        return
     ts = datetime.now(TZ).strftime("%Y%m%d_%H%M%S_%f")  # Timestamp
     path = SNAPSHOT_DIR / f"boat_{tid}_{ts}.jpg"  # Snapshot path
-    cv2.imwrite(str(path), frame)  # Save snapshot
-    log.debug(f"Snapshot saved {path.name}")  # Log snapshot saved
+    crop = np.ascontiguousarray(frame[y1:y2, x1:x2])  # One contiguous copy; the frame is drawn on later
+    try:
+        snap_q.put_nowait((path, crop))  # Hand off to the writer
+    except Full:
+        log.warning(f"Snapshot queue full — dropped {path.name}")  # Writer can't keep up
+
+
+sheet_q: Queue = Queue()  # Rows for the Sheets flusher; None = flush and exit
+
+
+def _sheet_flusher():
+    """Append queued rows in batches so Sheets round-trips never block the frame loop."""
+    rows: list = []  # Rows waiting for the next append_rows call
+    deadline = 0.0  # When the current batch must be sent
+    stop = False
+    while not stop:
+        try:
+            row = sheet_q.get(timeout=0.5)  # Wait briefly for the next row
+            if row is None:
+                stop = True  # Shutdown: flush what we have and exit
+            else:
+                rows.append(row)
+                deadline = deadline or time.time() + SHEET_FLUSH_SEC
+        except Empty:
+            pass
+        if not rows or not (stop or len(rows) >= SHEET_BATCH_ROWS or time.time() >= deadline):
+            continue  # Keep collecting
+        for attempt in range(1, SHEET_RETRIES + 1):
+            try:
+                sheet.append_rows(rows, value_input_option="RAW")  # type: ignore  # One round-trip per batch
+                log.debug(f"Sheets appended {len(rows)} rows")  # Log flush
+                rows = []
+                break
+            except Exception as e:
+                log.error(f"Sheets append failed ({len(rows)} rows, attempt {attempt}/{SHEET_RETRIES}): {e}")
+                if attempt < SHEET_RETRIES:
+                    time.sleep(RETRY_BACKOFF_SEC ** attempt)  # Exponential backoff
+        if stop and rows:
+            log.error(f"Sheets unreachable at shutdown — {len(rows)} rows not logged")  # Log lost rows
+        elif len(rows) > SHEET_MAX_PENDING:
+            log.error(f"Sheets backlog over {SHEET_MAX_PENDING} — dropping {len(rows) - SHEET_MAX_PENDING} oldest rows")
+            rows = rows[-SHEET_MAX_PENDING:]  # Keep the newest
+        deadline = time.time() + SHEET_FLUSH_SEC if rows else 0.0  # Unsent rows retry on the next flush
+
+
+_sheet_thread: Optional[threading.Thread] = None  # Flusher, only started when Sheets is connected
+if sheet is not None:
+    _sheet_thread = threading.Thread(target=_sheet_flusher, name="sheet-flusher", daemon=True)
+    _sheet_thread.start()  # Start flushing
 
 
 def log_to_sheet(tid: int):
     if sheet is None:
         return  # Do nothing if no sheet
-    try:
-        sheet.append_row([datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"), tid])  # type: ignore  # Append row
-    except Exception as e:
-        log.error(f"Sheets append failed: {e}")  # Log error
+    sheet_q.put_nowait([datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"), tid])  # Queue the row for the flusher
+
+# ───────────────────── Crossing bookkeeping ─────────────────────
+UNSEEN_X = np.iinfo(np.int32).min  # last-x sentinel for an ID not seen yet
+
+
+def _grown(arr: np.ndarray, n: int, fill) -> np.ndarray:
+    """*arr* doubled until index n-1 fits, new slots set to *fill* (returned unchanged if it already fits)."""
+    size = len(arr)
+    while size < n:
+        size *= 2
+    if size == len(arr):
+        return arr
+    out = np.full(size, fill, arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+
+@njit(cache=True)
+def process_tracks(tracks, last_x, last_count, line_x, now, cooldown):
+    """Update per-ID *last_x* / *last_count* from int32 rows [x1, y1, x2, y2, id]; True where a track counts."""
+    tids = tracks[:, 4]
+    centers = (tracks[:, 0] + tracks[:, 2]) // 2  # Center x of every track
+    prev = last_x[tids]
+    prev = np.where(prev == UNSEEN_X, centers, prev)  # New IDs start where they are
+    last_x[tids] = centers
+    fire = (prev < line_x) & (line_x <= centers) & (now - last_count[tids] > cooldown)  # Left→right, cooldown expired
+    last_count[tids[fire]] = now
+    return fire
 
 # ───────────────────── Main Processing Loop ─────────────────────
 
 def main():
-    cam = Camera()  # Initialize camera
+    cam = ThreadedCamera()  # Initialize camera
     boat_total = 0  # Total boats counted
-    id_last_x: Dict[int, int] = {}  # Last x position for each ID
-    id_last_count: Dict[int, float] = {}  # Last count time for each ID
+    # Per-track state indexed directly by track ID (both trackers hand out small increasing ints)
+    last_x = np.full(1024, UNSEEN_X, np.int32)  # Last center x per ID
+    last_count = np.full(1024, -np.inf)  # Last count time per ID (time.monotonic seconds)
     last_day_checked = datetime.now(TZ).date()  # Last day checked
+    day_check_next = 0.0  # Monotonic time of the next day/night check
+    masked: List[Optional[np.ndarray]] = [None] * BATCH  # Reused masked-ROI buffer per batch slot
+    pending: List[np.ndarray] = []  # YOLO inputs waiting for the next forward pass
+    originals: List[np.ndarray] = []  # Matching full frames (drawn on, cropped for snapshots)
+    t_first = 0.0  # When the oldest pending frame arrived
+    motion_bg: Optional[np.ndarray] = None  # Running-average grey thumbnail of the ROI
+    live_tracks = 0  # Tracks returned for the last processed frame
+    line_w = line_x = 0  # Frame width the count line was computed for, and its x
+    det_buf = np.empty((MAX_DET, 5), np.float32)  # Reused tracker input; max_det caps the rows
 
     try:
         while True:
-            now = datetime.now(TZ)  # Current time
-            if now.date() != last_day_checked:
-                last_day_checked = now.date()  # Update last day checked
-                log.debug("Sunrise/sunset window recalculated")  # Log recalculation
-
-            # Sleep at night
-            if not is_daytime(now):
-                log.info(f"Nighttime {now:%H:%M} — sleeping 5 min")  # Log sleep
-                cam.release()  # Release camera
-                time.sleep(300)  # Sleep for 5 minutes
-                cam = Camera()  # Re-initialize camera
-                continue  # Continue loop
-
-            ok, frame = cam.read()  # Read frame
-            if not ok or frame is None:
+            if time.monotonic() >= day_check_next:
+                day_check_next = time.monotonic() + DAY_CHECK_SEC  # Next check
+                now = datetime.now(TZ)  # Wall-clock time, only needed for the day/night decision
+                if now.date() != last_day_checked:
+                    last_day_checked = now.date()  # Update last day checked
+                    log.debug("Sunrise/sunset window recalculated")  # Log recalculation
+
+                # Sleep at night
+                if not is_daytime(now):
+                    log.info(f"Nighttime {now:%H:%M} — sleeping 5 min")  # Log sleep
+                    pending.clear()  # Drop a half-filled batch
+                    originals.clear()
+                    cam.release()  # Release camera
+                    time.sleep(300)  # Sleep for 5 minutes
+                    cam = ThreadedCamera()  # Re-initialize camera
+                    continue  # Continue loop
+
+            # With a batch started, only wait out what's left of BATCH_WAIT_SEC
+            wait = max(0.0, t_first + BATCH_WAIT_SEC - time.monotonic()) if pending else 2.0
+            ok, frame = cam.latest(wait)  # Newest frame from the reader thread
+            if ok and frame is not None:
+                frame_proc = frame[ROI_Y0:ROI_Y1, ROI_X0:ROI_X1]  # Crop to the mask's bounding box (a view, no copy)
+
+                # Motion gate: tiny grey thumbnail against a running-average background
+                small = cv2.resize(cv2.cvtColor(frame_proc, cv2.COLOR_BGR2GRAY), MOTION_SIZE,
+                                   interpolation=cv2.INTER_AREA)  # Thumbnail
+                if motion_bg is None:
+                    motion_bg = small.astype(np.float32)  # First frame seeds the background
+                diff = cv2.absdiff(small, cv2.convertScaleAbs(motion_bg))  # Change vs background
+                moving = cv2.countNonZero(cv2.threshold(diff, MOTION_PIXEL_DIFF, 255, cv2.THRESH_BINARY)[1])
+                cv2.accumulateWeighted(small, motion_bg, MOTION_EMA)  # EMA background update
+                if not pending and live_tracks == 0 and moving < MOTION_MIN_PIX:
+                    # Static scene, nothing being tracked — skip YOLO, but still age coasting tracks
+                    live_tracks = len(tracker.update(np.empty((0, 5), np.float32)))
+                    continue
+
+                if MASK is not None:
+                    slot = len(pending)  # Each batch slot needs its own buffer
+                    if masked[slot] is None or masked[slot].shape != frame_proc.shape:
+                        masked[slot] = np.empty_like(frame_proc)  # Allocate once, reuse every batch
+                    frame_proc = np.multiply(frame_proc, MASK, out=masked[slot])  # Blank pixels outside the mask
+                if not pending:
+                    t_first = time.monotonic()  # Batch latency starts now
+                pending.append(frame_proc)  # Queue for the forward pass
+                originals.append(frame)
+            elif not pending:
                 log.warning("Frame grab failed — retrying")  # Log warning
                 time.sleep(0.1)  # Short sleep
                 continue  # Continue loop
 
-            frame_proc = cv2.bitwise_and(frame, frame, mask=MASK) if MASK is not None else frame  # Apply mask if present
-
-            # YOLO inference
-            detections: List[List[float]] = []  # List for detections
-            for r in model(frame_proc, conf=CONF_THRESHOLD, verbose=False):  # Run model
-                for box, conf, cls in zip(r.boxes.xyxy.cpu(), r.boxes.conf.cpu(), r.boxes.cls.cpu()):  # Iterate detections
-                    # Filter only boats (COCO class 8 = boat) – adjust if you trained custom classes
-                    if int(cls) != 8:
-                        continue  # Skip non-boat
-                    x1, y1, x2, y2 = box.tolist()  # Get box coordinates
-                    detections.append([x1, y1, x2, y2, float(conf)])  # Add detection
-
-            # Run tracker  ───────────────────────────────────────────
-            if len(detections) == 0:
-                tracks = np.empty((0, 5))  # Empty tracks when no detections
-            else:
-                tracks = tracker.update(np.array(detections, dtype=np.float32))  # Update tracker
-
-            # Draw & count  ─────────────────────────────────────────
-            line_x = int(frame.shape[1] * COUNT_LINE_RATIO)  # Calculate line x
-            cv2.line(frame, (line_x, 0), (line_x, frame.shape[0]), (0, 255, 255), 2)  # Draw count line
+            # Run YOLO once the batch is full or its oldest frame has waited long enough
+            if len(pending) < BATCH and time.monotonic() - t_first < BATCH_WAIT_SEC:
+                continue  # Wait for the next frame
 
-            for x1, y1, x2, y2, tid in tracks:
-                x1, y1, x2, y2, tid = map(int, [x1, y1, x2, y2, tid])  # Convert to int
-
-                # Draw track box & ID
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)  # Draw rectangle
-                cv2.putText(frame, f"ID {tid}", (x1, y1 - 5),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)  # Draw ID
-
-                # Count when crossing line (left→right)
-                center_x = (x1 + x2) // 2  # Calculate center x
-                last_x = id_last_x.get(tid, center_x)  # Get last x
-                id_last_x[tid] = center_x  # Update last x
-
-                crossed = last_x < line_x <= center_x  # Check if crossed
-                cooldown_ok = (time.time() - id_last_count.get(tid, 0)) > COOLDOWN_SEC  # Check cooldown
-
-                if crossed and cooldown_ok:
+            # YOLO inference — one forward pass for the whole batch
+            # classes= filters to boats inside NMS; stream=True yields results as a generator
+            if USE_NUMBA_PREPROCESS:
+                source, box_scale, box_shift = preprocess(pending)  # Tensor input: Ultralytics skips its letterbox
+            else:
+                source, box_scale, box_shift = pending, 1.0, ROI_OFFSET  # Ultralytics maps boxes back itself
+            results = model.predict(source, conf=CONF_THRESHOLD, iou=NMS_IOU, imgsz=IMGSZ, classes=[BOAT_CLASS_ID],
+                                    max_det=MAX_DET, verbose=False, stream=True)  # Run model
+            quit_requested = False  # Set by the preview window's 'q'
+            for r, frame in zip(results, originals):  # Frames in capture order, so tracking stays sequential
+                # All boxes in one copy each; classes= already dropped non-boats
+                xyxy = r.boxes.xyxy.cpu().numpy()  # Boxes in model-input coordinates
+                conf = r.boxes.conf.cpu().numpy()  # Confidences
+                if len(conf) > len(det_buf):
+                    det_buf = np.empty((len(conf), 5), np.float32)  # Only if max_det was raised
+                dets = det_buf[:len(conf)]  # (N, 5) view, no allocation
+                np.multiply(xyxy, box_scale, out=dets[:, :4])  # Model input → full frame…
+                dets[:, :4] += box_shift
+                dets[:, 4] = conf
+
+                # Run tracker  ───────────────────────────────────────────
+                tracks = tracker.update(dets)  # Every frame, even with no boats, so lost tracks age out
+                live_tracks = len(tracks)  # Keeps YOLO running while anything is tracked
+
+                # Count  ─────────────────────────────────────────────────
+                if frame.shape[1] != line_w:  # Constant geometry: only recomputed if the frame width changes
+                    line_w = frame.shape[1]
+                    line_x = int(line_w * COUNT_LINE_RATIO)  # Calculate line x
+
+                tr = tracks.astype(np.int32)  # Int boxes and IDs for all tracks at once
+                tids = tr[:, 4]  # Track IDs
+                if len(tids) and tids.max() >= len(last_x):  # New high ID: grow both arrays
+                    last_x = _grown(last_x, int(tids.max()) + 1, UNSEEN_X)
+                    last_count = _grown(last_count, int(tids.max()) + 1, -np.inf)
+                fire = process_tracks(tr, last_x, last_count, line_x, time.monotonic(), COOLDOWN_SEC)  # Compiled
+
+                for x1, y1, x2, y2, tid in tr[fire].tolist():  # Only the tracks that just crossed
                     boat_total += 1  # Increment boat count
-                    id_last_count[tid] = time.time()  # Update last count time
                     log.info(f"Boat #{boat_total}  (track ID {tid})")  # Log count
-                    save_snapshot(frame[y1:y2, x1:x2], tid)  # Save snapshot
+                    save_snapshot(frame, (x1, y1, x2, y2), tid)  # Save snapshot
                     log_to_sheet(tid)  # Log to sheet
 
-            # ---------- optional HDMI preview ----------
-            if DISPLAY_WINDOW:
-                cv2.putText(frame, f"Total: {boat_total}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)  # Draw total
-                cv2.imshow("Boat Counter", frame)  # Show frame
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break  # Exit on 'q'
+                # ---------- optional HDMI preview (headless runs draw nothing) ----------
+                if DISPLAY_WINDOW:
+                    cv2.line(frame, (line_x, 0), (line_x, frame.shape[0]), (0, 255, 255), 2)  # Draw count line
+                    for x1, y1, x2, y2, tid in tr.tolist():
+                        # Draw track box & ID
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)  # Draw rectangle
+                        cv2.putText(frame, f"ID {tid}", (x1, y1 - 5),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)  # Draw ID
+                    cv2.putText(frame, f"Total: {boat_total}", (10, 30),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)  # Draw total
+                    cv2.imshow("Boat Counter", frame)  # Show frame
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        quit_requested = True  # Exit on 'q'
+                        break
+            pending.clear()  # Batch done
+            originals.clear()
+            if quit_requested:
+                break
 
     except KeyboardInterrupt:
         log.info("Ctrl-C received — exiting")  # Log exit
     finally:
         cam.release()  # Release camera
+        snap_q.put(None)  # Stop the snapshot writer once the queue drains
+        _snap_thread.join(timeout=10)  # Let pending snapshots finish
+        if _sheet_thread is not None:
+            sheet_q.put(None)  # Flush remaining rows
+            _sheet_thread.join(timeout=30)  # Give the final append and its retries time to finish
         if DISPLAY_WINDOW:
             cv2.destroyAllWindows()  # Destroy windows
         log.info("Shutdown complete")  # Log shutdown
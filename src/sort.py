@@ -33,15 +33,20 @@ from filterpy.kalman import KalmanFilter
 np.random.seed(0)
 
 
+try:
+  import lap  # lapjv is several times faster than scipy for SORT-sized matrices
+except ImportError:
+  lap = None
+  from scipy.optimize import linear_sum_assignment
+
+
 def linear_assignment(cost_matrix):
-  try:
-    import lap
+  if lap is not None:
     _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-    return np.array([[y[i],i] for i in x if i >= 0]) #
-  except ImportError:
-    from scipy.optimize import linear_sum_assignment
-    x, y = linear_sum_assignment(cost_matrix)
-    return np.array(list(zip(x, y)))
+    cols = x[x >= 0]
+    return np.stack((y[cols], cols), axis=1)
+  x, y = linear_sum_assignment(cost_matrix)
+  return np.stack((x, y), axis=1)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -252,6 +257,75 @@ class Sort(object):
       return np.concatenate(ret)
     return np.empty((0,5))
 
+
+class IOUTracker(object):
+  """
+  Greedy IoU tracker with the same update() contract as Sort, but no Kalman filter:
+  a track's box is simply its last matched detection. Much cheaper per frame, and good
+  enough when objects move little between consecutive frames (fixed camera, full frame
+  rate); at low frame rates Sort's motion model keeps IDs more reliably.
+  """
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+    self.max_age = max_age
+    self.min_hits = min_hits
+    self.iou_threshold = iou_threshold
+    self.boxes = np.empty((0, 4))
+    self.ids = np.empty(0, dtype=int)
+    self.hit_streak = np.empty(0, dtype=int)
+    self.time_since_update = np.empty(0, dtype=int)
+    self.next_id = 1
+    self.frame_count = 0
+
+  def update(self, dets=np.empty((0, 5))):
+    """
+    Params:
+      dets - a numpy array of detections in the format [[x1,y1,x2,y2,score],[x1,y1,x2,y2,score],...]
+    Requires: call once per frame, even with no detections.
+    Returns [[x1,y1,x2,y2,id],...] for tracks matched this frame that have been seen min_hits times.
+    """
+    self.frame_count += 1
+    dets = np.asarray(dets, dtype=float).reshape(-1, 5)
+    n_trk = len(self.ids)
+    det_trk = np.full(len(dets), -1)
+
+    if len(dets) and n_trk:
+      iou = iou_batch(dets[:, :4], self.boxes)
+      used_det = np.zeros(len(dets), dtype=bool)
+      used_trk = np.zeros(n_trk, dtype=bool)
+      # greedy assignment, best overlaps first
+      for flat in np.argsort(-iou, axis=None):
+        d, t = divmod(int(flat), n_trk)
+        if iou[d, t] < self.iou_threshold:
+          break
+        if not (used_det[d] or used_trk[t]):
+          used_det[d] = used_trk[t] = True
+          det_trk[d] = t
+
+    matched = det_trk >= 0
+    trk_idx = det_trk[matched]
+    self.time_since_update += 1
+    self.hit_streak[self.time_since_update > 1] = 0
+    self.boxes[trk_idx] = dets[matched, :4]
+    self.time_since_update[trk_idx] = 0
+    self.hit_streak[trk_idx] += 1
+
+    # new tracks for unmatched detections
+    new = dets[~matched, :4]
+    self.boxes = np.concatenate((self.boxes, new))
+    self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + len(new))))
+    self.hit_streak = np.concatenate((self.hit_streak, np.zeros(len(new), dtype=int)))
+    self.time_since_update = np.concatenate((self.time_since_update, np.zeros(len(new), dtype=int)))
+    self.next_id += len(new)
+
+    out = (self.time_since_update < 1) & ((self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+    ret = np.concatenate((self.boxes[out], self.ids[out, None]), axis=1)
+
+    # remove dead tracklets
+    alive = self.time_since_update <= self.max_age
+    self.boxes, self.ids = self.boxes[alive], self.ids[alive]
+    self.hit_streak, self.time_since_update = self.hit_streak[alive], self.time_since_update[alive]
+    return ret
+
 def parse_args():
     """Parse input arguments."""
     parser = argparse.ArgumentParser(description='SORT demo')